@@ -0,0 +1,165 @@
+"""
+Direct access to the REST endpoints of impfterminservice.de (the same ones used by process.js).
+
+A browser session is only needed to bootstrap the cookies of a host (e.g. to get past the waiting room),
+all further requests are done using a pooled HTTP client.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from cache import ResponseCache
+from scheduler import BACKOFF_SEC, MAX_BACKOFF_SEC
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+DAYTIME = '11111111111111'
+RADIUS = 10
+TIMEOUT_SEC = 10
+
+
+class ApiError(Exception):
+    def __init__(self, message, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def get_host(url):
+    return urlparse(url).netloc
+
+
+def get_authorization(code):
+    # the site uses basic auth with an empty user and the reservation code as password
+    return 'Basic ' + base64.b64encode(f':{code}'.encode()).decode()
+
+
+def has_appointments(ersttermin: dict) -> bool:
+    return bool(ersttermin.get('termine') or ersttermin.get('termineTSS'))
+
+
+def get_vaccine_codes(vaccination_list: list) -> set:
+    # the code is named 'qualification', older versions of the site used 'qualifikation'
+    return {entry.get('qualification') or entry.get('qualifikation') for entry in vaccination_list}
+
+
+class ApiClient:
+    def __init__(self, pool_size=4, cache: ResponseCache = None):
+        # only needed by the "api" check engine
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept'] = 'application/json, text/plain, */*'
+        self.hosts = set()
+        # host -> (failures, cool down until), only for the further centers of a party, see throttle()
+        self.cooldowns = {}
+        # for the concurrent requests to several centers, see get_first_ersttermin()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='api')
+
+    def is_bootstrapped(self, url):
+        return get_host(url) in self.hosts
+
+    def bootstrap(self, browser: WebDriver, url):
+        """Copies the cookies and the user agent of the (already authenticated) browser session."""
+        for cookie in browser.get_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        self.session.headers['User-Agent'] = browser.execute_script('return navigator.userAgent')
+        self.hosts.add(get_host(url))
+
+    def invalidate(self, url):
+        self.hosts.discard(get_host(url))
+
+    def is_cooling_down(self, url) -> bool:
+        return self.cooldowns.get(get_host(url), (0, 0.0))[1] > time.monotonic()
+
+    def throttle(self, url) -> float:
+        """
+        Lets a failing host cool down with an exponential backoff (like the scheduler does for the party's own
+        center), returns the cool down in seconds.
+        """
+        host = get_host(url)
+        failures = self.cooldowns.get(host, (0, 0.0))[0] + 1
+        cooldown = min(MAX_BACKOFF_SEC, BACKOFF_SEC * 2 ** (failures - 1)) * random.uniform(0.5, 1.5)
+        self.cooldowns[host] = failures, time.monotonic() + cooldown
+        return cooldown
+
+    def reset_throttle(self, url):
+        self.cooldowns.pop(get_host(url), None)
+
+    def get(self, url, code=None):
+        import requests
+
+        headers = {'Referer': url}
+        if code:
+            headers['Authorization'] = get_authorization(code)
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=TIMEOUT_SEC)
+        except requests.RequestException as e:
+            raise ApiError(f'request to {url} failed: {e}')
+
+        if response.status_code != 200:
+            # most likely the session is not valid anymore (e.g. 429 or a new waiting room)
+            self.invalidate(url)
+            raise ApiError(f'got {response.status_code} response from {url}', response.status_code)
+
+        return response
+
+    def get_ersttermin(self, url, postal_code, vaccine_code, code=None, radius=RADIUS) -> dict:
+        response = self.get(f'{url}rest/suche/ersttermin?allOf=&someOf={vaccine_code}&plz={postal_code}'
+                            f'&daytime={DAYTIME}&radius={radius}', code)
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            self.invalidate(url)
+            raise ApiError(f'unable to parse the ersttermin response: {response.text[:200]}')
+
+    def get_first_ersttermin(self, urls: List[str], postal_code, vaccine_code, code=None, radius=RADIUS) \
+            -> Tuple[Optional[str], Dict[str, Union[dict, ApiError]]]:
+        """
+        Queries the ersttermin endpoints of the centers concurrently and returns as soon as one of them has
+        appointments: (url of that center, responses so far). Otherwise (None, all responses), each response being
+        the ersttermin data or the ApiError of the center. The requests still running are not waited for.
+        """
+        pending = {self.executor.submit(self.get_ersttermin, url, postal_code, vaccine_code, code, radius): url
+                   for url in urls}
+        results = {}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                try:
+                    results[url] = future.result()
+                except ApiError as e:
+                    results[url] = e
+                    continue
+                if has_appointments(results[url]):
+                    for other in pending:
+                        other.cancel()
+                    return url, results
+        return None, results
+
+    def get_vaccination_list(self, url) -> list:
+        """The vaccination list of the center, from the cache (if any) as long as the site version is the same."""
+        def fetch():
+            return self.get(f'{url}assets/static/its/vaccination-list.json').json()
+
+        if self.cache:
+            return self.cache.get_or_fetch(get_host(url), 'vaccination-list', fetch, lambda: self.get_version(url))
+        return fetch()
+
+    def get_version(self, url) -> str:
+        return self.get(f'{url}rest/version').text
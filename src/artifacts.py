@@ -0,0 +1,98 @@
+"""
+Write-minimizing store of the files in out/ (page sources, console and cookie dumps, ...): files are written
+atomically and only if their content changed, logs are appended incrementally and rotated, and old error dumps
+and rotated logs are removed after the retention period.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Iterable
+
+RETENTION_SEC = 7 * 24 * 60 * 60
+# patterns of the files removed after the retention period
+RETENTION_PATTERNS = ('error-*', '*.jsonl.1')
+PRUNE_INTERVAL_SEC = 60 * 60
+MAX_LOG_BYTES = 1024 * 1024
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+class ArtifactStore:
+    def __init__(self, path, retention_sec=RETENTION_SEC, max_log_bytes=MAX_LOG_BYTES):
+        self.path = path
+        self.retention_sec = retention_sec
+        self.max_log_bytes = max_log_bytes
+        self.lock = threading.Lock()
+        # filename -> digest of the content on disk
+        self.digests = {}
+        self.last_prune = None
+
+    def _file(self, filename):
+        return os.path.join(self.path, filename)
+
+    def write(self, filename, content) -> bool:
+        """Replaces the file atomically if the content changed, returns False if the file was up-to-date."""
+        data = content.encode() if isinstance(content, str) else content
+        digest = _digest(data)
+        file = self._file(filename)
+
+        with self.lock:
+            if filename not in self.digests and os.path.exists(file):
+                # e.g. after a restart
+                with open(file, 'rb') as f:
+                    self.digests[filename] = _digest(f.read())
+            if self.digests.get(filename) == digest and os.path.exists(file):
+                return False
+
+            fd, tmp_file = tempfile.mkstemp(dir=self.path, prefix=f'.{filename}.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_file, file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+            self.digests[filename] = digest
+
+        self.prune()
+        return True
+
+    def append(self, filename, records: Iterable):
+        """Appends the records as JSON lines, the file is rotated (to filename.1) once it exceeds max_log_bytes."""
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        if not lines:
+            return
+
+        file = self._file(filename)
+        with self.lock:
+            if os.path.exists(file) and os.path.getsize(file) > self.max_log_bytes:
+                os.replace(file, f'{file}.1')
+            with open(file, 'a') as f:
+                f.write(lines)
+
+        self.prune()
+
+    def prune(self, force=False):
+        """Removes the files matching RETENTION_PATTERNS older than the retention period (at most once an hour)."""
+        now = time.monotonic()
+        if not self.retention_sec or (not force and self.last_prune is not None
+                                      and now - self.last_prune < PRUNE_INTERVAL_SEC):
+            return
+        self.last_prune = now
+
+        deadline = time.time() - self.retention_sec
+        for pattern in RETENTION_PATTERNS:
+            for file in glob.glob(self._file(pattern)):
+                try:
+                    if os.path.getmtime(file) < deadline:
+                        os.remove(file)
+                except OSError:
+                    # removed meanwhile
+                    pass
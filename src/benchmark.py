@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the check engines against the local mock impfterminservice (see mock_server.py), reporting
+checks/sec, the per-check latency percentiles and the memory usage for N parties.
+
+    python benchmark.py --parties 20 --passes 5 --workers 2 --engine api --latency 0.1
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import queue
+import resource
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from api import ApiClient, get_host
+from cache import ResponseCache
+from events import percentile
+from mock_server import MockConfig, start_server
+
+
+def get_party_name(index):
+    # the party identifier only keeps letters, so the names must not differ by digits only
+    name = ''
+    while True:
+        name = string.ascii_lowercase[index % 26] + name
+        index = index // 26 - 1
+        if index < 0:
+            return f'bench {name}'
+
+
+def get_tree_rss_mb(pid):
+    """Current RSS of the process and all its descendants (e.g. chromedriver and chrome), Linux only."""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as file:
+                    parents[int(entry)] = int(file.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError):
+                pass
+
+    tree = {pid}
+    changed = True
+    while changed:
+        children = {child for child, parent in parents.items() if parent in tree} - tree
+        tree |= children
+        changed = bool(children)
+
+    rss_kb = 0
+    for process_id in tree:
+        try:
+            with open(f'/proc/{process_id}/status') as file:
+                rss_kb += next(int(line.split()[1]) for line in file if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            pass
+    return rss_kb / 1024
+
+
+def run_benchmark(args):
+    server = start_server(MockConfig(args.latency, args.error_rate, args.pages))
+    url = f'http://127.0.0.1:{server.server_address[1]}/{args.scenario}/'
+
+    parties = [main.Party(name=get_party_name(i), recipient='bench@localhost', address={}, url=url,
+                          code='BENC-HMAR-KXXX' if args.code or args.engine == 'api' else None,
+                          postal_code=f'{10000 + i}', age=60, vaccine_code='L920')
+               for i in range(args.parties)]
+
+    # like in the service, the vaccination list is only fetched once per site version
+    cache = ResponseCache()
+    workers = []
+    for i in range(args.workers):
+        if args.engine == 'api':
+            api = ApiClient(cache=cache)
+            # the mock does not need a session, so the browser bootstrap is skipped
+            api.hosts.add(get_host(url))
+            # the browser is only needed to verify available appointments
+            browser = main.setup_browser() if 'appointments' in args.scenario.split(',') else None
+            workers.append(main.Worker(id=i, browser=browser, api=api))
+        else:
+            workers.append(main.Worker(id=i, browser=main.setup_browser()))
+
+    idle_workers = queue.Queue()
+    for worker in workers:
+        idle_workers.put(worker)
+
+    latencies = []
+    errors = []
+    peak_rss_mb = 0
+
+    def check(party):
+        nonlocal peak_rss_mb
+        worker = idle_workers.get()
+        start = time.monotonic()
+        try:
+            worker.begin_check(party)
+            if args.engine == 'api':
+                main.process_api(worker, party)
+            else:
+                main.process(worker, party)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if worker.api:
+                # a 429 response drops the session of the host, the mock does not need one, so there is nothing to
+                # bootstrap (the workers may not even have a browser)
+                worker.api.hosts.add(get_host(party.url))
+            latencies.append(time.monotonic() - start)
+            peak_rss_mb = max(peak_rss_mb, get_tree_rss_mb(os.getpid()))
+            idle_workers.put(worker)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        for _ in range(args.passes):
+            list(executor.map(check, parties))
+    elapsed = time.monotonic() - start
+
+    for worker in workers:
+        if worker.browser:
+            worker.browser.quit()
+    server.shutdown()
+
+    return {
+        'checks': len(latencies),
+        'errors': len(errors),
+        'elapsed': elapsed,
+        'checks_per_sec': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'peak_rss_mb': peak_rss_mb,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Corona Impf-o-mat :: benchmark against the local mock server')
+    parser.add_argument('--parties', type=int, default=10)
+    parser.add_argument('--passes', help="Number of checks per party", type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--engine', choices=['browser', 'api'], default='api')
+    parser.add_argument('--scenario', help="Scenario flags of the mock server, see mock_server.py",
+                        default='no_appointments')
+    parser.add_argument('--code', help="Use the code flow instead of the age form (always with --engine api, "
+                                       "which only checks parties with a code)", action='store_true')
+    parser.add_argument('--latency', help="Added latency per request in seconds", type=float, default=0.0)
+    parser.add_argument('--error-rate', help="Share of the REST requests answered with 429", type=float, default=0.0)
+    parser.add_argument('--pages', help="Directory with recorded pages replacing the built-in templates")
+    parser.add_argument('--headless', help="Use Chrome's headless mode instead of Xvfb", action='store_true')
+    parser.add_argument('--verbose', help="Show the output of the checks", action='store_true')
+    args = parser.parse_args()
+
+    main.browser_config = main.BrowserConfig(headless=args.headless)
+    use_display = not args.headless and (args.engine == 'browser' or 'appointments' in args.scenario.split(','))
+    if use_display:
+        main.start_display()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        result = run_benchmark(args)
+
+    if use_display:
+        main.stop_display()
+
+    print(f"checks: {result['checks']} (errors: {result['errors']}) in {result['elapsed']:.1f}s")
+    print(f"checks/sec: {result['checks_per_sec']:.2f}")
+    print(f"latency p50: {result['p50']:.3f}s p99: {result['p99']:.3f}s")
+    print(f"memory: peak RSS {result['peak_rss_mb']:.0f} MB (incl. browsers), "
+          f"max RSS {result['max_rss_mb']:.0f} MB (python)")
+    if result['first_error']:
+        print(f"first error: {result['first_error']}")
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,102 @@
+"""
+Automatic booking (opt-in per party, see `auto_book` in config-example.yml): right after a check with a code has
+found appointments, the first slot pair is selected in the same browser session, the personal data form is filled
+from the party's address and the booking is submitted.
+
+The steps follow the booking dialog of impfterminservice.de. The buttons are found by their labels and the form
+fields by their Angular form control names (see FIELDS), so the flow can be tested against the mock server or a
+recorded page set (mock_server.py --pages).
+"""
+
+from waits import FIND_BUTTON_JS, TIMEOUTS, button_present, element_present, page_contains, xhr_idle, all_of
+
+SLOT_PAIR = '.its-slot-pair-search-info'
+
+# button labels in the order they are clicked
+SELECT_BUTTON = 'Auswählen'
+ENTER_DATA_BUTTON = 'Daten erfassen'
+APPLY_BUTTON = 'Übernehmen'
+BOOK_BUTTON = 'Verbindlich buchen'
+
+BOOKED_TEXT = 'Ihr Termin am'
+
+# Address field -> form control name of the personal data form
+FIELDS = {
+    'name': 'firstname',
+    'surname': 'lastname',
+    'postal_code': 'plz',
+    'city': 'city',
+    'street': 'street',
+    'street_no': 'housenumber',
+    'phone': 'phone',
+    'email': 'notificationReceiver',
+}
+
+# the salutation is a radio button, selected by its label (e.g. "Frau", "Herr", "Divers")
+_CLICK_LABEL_JS = """
+const text = arguments[0].toLowerCase();
+const label = Array.from(document.querySelectorAll('label'))
+    .find(label => label.textContent.trim().toLowerCase() === text);
+if (label) label.click();
+return label !== undefined;
+"""
+
+
+class BookingError(Exception):
+    pass
+
+
+def get_missing_fields(address) -> list:
+    """The address fields needed for the booking which are not set."""
+    return [name for name in ('salutation', *FIELDS) if not getattr(address, name, None)]
+
+
+def click_button(worker, text):
+    if not worker.wait(button_present(text), TIMEOUTS['booking']):
+        raise BookingError(f'button "{text}" not found')
+    worker.browser.execute_script(FIND_BUTTON_JS, text).click()
+
+
+def fill_form(worker, address):
+    browser = worker.browser
+    if not browser.execute_script(_CLICK_LABEL_JS, address.salutation):
+        raise BookingError(f'salutation "{address.salutation}" not found')
+
+    for name, control in FIELDS.items():
+        elements = browser.find_elements_by_css_selector(f'input[formcontrolname="{control}"]')
+        if not elements:
+            raise BookingError(f'form field "{control}" not found')
+        elements[0].clear()
+        elements[0].send_keys(str(getattr(address, name)))
+
+
+def book(worker, address) -> str:
+    """
+    Books the first slot pair on the current search result page, returns the booking confirmation (e.g.
+    "Ihr Termin am 01.06.2021 um 10:00 Uhr"). Raises a BookingError if a step fails.
+    """
+    missing = get_missing_fields(address)
+    if missing:
+        raise BookingError(f'address incomplete, missing: {", ".join(missing)}')
+
+    browser = worker.browser
+    with worker.timer.step('book'):
+        slots = browser.find_elements_by_css_selector(SLOT_PAIR)
+        if not slots:
+            raise BookingError('no slot pair found')
+        radios = slots[0].find_elements_by_css_selector('input[type="radio"]')
+        (radios[0] if radios else slots[0]).click()
+        click_button(worker, SELECT_BUTTON)
+
+        click_button(worker, ENTER_DATA_BUTTON)
+        if not worker.wait(element_present('input[formcontrolname]'), TIMEOUTS['booking']):
+            raise BookingError('personal data form not found')
+        fill_form(worker, address)
+        click_button(worker, APPLY_BUTTON)
+
+        click_button(worker, BOOK_BUTTON)
+        if not worker.wait(all_of(xhr_idle, page_contains(BOOKED_TEXT)), TIMEOUTS['booking']):
+            raise BookingError('no booking confirmation')
+
+    headlines = browser.find_elements_by_css_selector('h2.ets-booking-headline')
+    return headlines[0].text if headlines else BOOKED_TEXT
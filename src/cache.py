@@ -0,0 +1,83 @@
+"""
+Shared cache of the slow-changing data of each center host (e.g. the vaccination list), keyed by the version of
+the site: the version (/rest/version) is checked at most every VERSION_TTL_SEC, a new version drops all cached
+data of the host. The cache is optionally kept on disk between runs.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable
+
+VERSION_TTL_SEC = 10 * 60
+# upper bound, even if the version doesn't change
+MAX_AGE_SEC = 24 * 60 * 60
+
+
+class ResponseCache:
+    def __init__(self, path=None, version_ttl_sec=VERSION_TTL_SEC, max_age_sec=MAX_AGE_SEC):
+        self.path = path
+        self.version_ttl_sec = version_ttl_sec
+        self.max_age_sec = max_age_sec
+        self.lock = threading.RLock()
+        # host -> {'version': str, 'version_checked': timestamp, 'data': {key: [timestamp, value]}}
+        self.hosts = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.hosts = json.load(file)
+            except ValueError:
+                print(f'ignoring the invalid cache file {path}')
+
+    def _host(self, host) -> dict:
+        return self.hosts.setdefault(host, {'version': None, 'version_checked': 0, 'data': {}})
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.hosts, file)
+        os.replace(tmp_path, self.path)
+
+    def needs_version_check(self, host) -> bool:
+        with self.lock:
+            return time.time() - self._host(host)['version_checked'] > self.version_ttl_sec
+
+    def update_version(self, host, version) -> bool:
+        """Returns True if the version has changed, the cached data of the host is dropped then."""
+        with self.lock:
+            entry = self._host(host)
+            changed = entry['version'] != version
+            if changed:
+                if entry['version'] is not None:
+                    print(f'{host}: new version {version}, dropping the cached data')
+                entry['version'] = version
+                entry['data'] = {}
+            entry['version_checked'] = time.time()
+            self._save()
+            return changed
+
+    def get(self, host, key):
+        """The cached value or None, without any request."""
+        with self.lock:
+            cached = self._host(host)['data'].get(key)
+            if cached is None or time.time() - cached[0] > self.max_age_sec:
+                return None
+            return cached[1]
+
+    def put(self, host, key, value):
+        with self.lock:
+            self._host(host)['data'][key] = [time.time(), value]
+            self._save()
+
+    def get_or_fetch(self, host, key, fetch: Callable, fetch_version: Callable):
+        """Returns the cached value, it is fetched if missing or if the version of the host has changed."""
+        if self.needs_version_check(host):
+            self.update_version(host, fetch_version())
+        value = self.get(host, key)
+        if value is None:
+            value = fetch()
+            self.put(host, key, value)
+        return value
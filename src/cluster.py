@@ -0,0 +1,163 @@
+"""
+Coordinator/worker mode: the coordinator owns the party list, the state and the scheduler and hands out check
+leases to stateless workers (each with its own browser) over a small line based JSON protocol on TCP:
+
+    {"op": "claim", "token": ...}                                 -> {"id": ..., "item": ...} or {"id": null, ...}
+    {"op": "complete", "token": ..., "id": ..., "result": ...}    -> {"ok": true}
+
+An item is only leased to one worker at a time. A lease not completed within LEASE_SEC (e.g. the worker died) is
+given back to the scheduler and checked again, a late result of an expired lease is ignored.
+"""
+
+import hmac
+import json
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Tuple
+
+from scheduler import Scheduler
+
+# longer than the slowest check, see TIMEOUTS['waiting_room']
+LEASE_SEC = 30 * 60
+# long polling of the claim requests
+CLAIM_TIMEOUT_SEC = 30
+# the coordinator keeps answering "finished" for a while, so all workers are able to stop
+FINISH_GRACE_SEC = 5
+RECONNECT_SEC = 10
+
+
+class ClusterError(Exception):
+    pass
+
+
+def parse_address(address: str, default_host='localhost') -> Tuple[str, int]:
+    """'host:port' or just 'port'."""
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    return host == 'localhost' or host.startswith('127.') or host == '::1'
+
+
+@dataclass
+class Lease:
+    item: Any
+    host: str
+    expires: float
+
+
+class Coordinator:
+    """
+    Hands out the items of the scheduler as leases. `encode(item)` returns the JSON payload of a lease,
+    `complete(item, result)` applies the result of a worker and returns the delay of the next check (None to drop
+    the item).
+    """
+
+    def __init__(self, scheduler: Scheduler, encode: Callable[[Any], dict], complete: Callable[[Any, dict], float],
+                 get_host: Callable[[Any], str], token: str = None, lease_sec=LEASE_SEC):
+        self.scheduler = scheduler
+        self.encode = encode
+        self.complete_item = complete
+        self.get_host = get_host
+        self.token = token
+        self.lease_sec = lease_sec
+        self.lock = threading.Lock()
+        self.leases = {}
+
+    def claim(self) -> dict:
+        item = self.scheduler.get(timeout=CLAIM_TIMEOUT_SEC)
+        if item is None:
+            return {'id': None, 'finished': self.scheduler.finished}
+
+        lease_id = uuid.uuid4().hex
+        with self.lock:
+            self.leases[lease_id] = Lease(item, self.get_host(item), time.monotonic() + self.lease_sec)
+        return {'id': lease_id, 'item': self.encode(item)}
+
+    def complete(self, lease_id, result: dict) -> dict:
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            print(f'ignore the result of the expired lease {lease_id}')
+            return {'ok': False}
+
+        delay = None
+        try:
+            delay = self.complete_item(lease.item, result)
+        finally:
+            self.scheduler.done(lease.item, lease.host, delay, bool(result.get('throttled')))
+        return {'ok': True}
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [lease_id for lease_id, lease in self.leases.items() if lease.expires <= now]
+            leases = [self.leases.pop(lease_id) for lease_id in expired]
+        for lease in leases:
+            print(f'lease of {lease.host} expired, check again')
+            self.scheduler.done(lease.item, lease.host, 0)
+
+    def handle(self, message: dict) -> dict:
+        if self.token and not hmac.compare_digest(str(message.get('token')), self.token):
+            return {'error': 'invalid token'}
+        if message.get('op') == 'claim':
+            return self.claim()
+        if message.get('op') == 'complete':
+            return self.complete(message['id'], message['result'])
+        return {'error': f"unknown operation {message.get('op')}"}
+
+    def serve(self, address: Tuple[str, int]):
+        """Serves the workers until there is nothing left to be checked."""
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    response = coordinator.handle(json.loads(self.rfile.readline()))
+                except (ValueError, KeyError) as e:
+                    response = {'error': f'invalid request: {e}'}
+                self.wfile.write((json.dumps(response) + '\n').encode())
+
+        server = socketserver.ThreadingTCPServer(address, Handler, bind_and_activate=False)
+        server.daemon_threads = True
+        server.allow_reuse_address = True
+        server.server_bind()
+        server.server_activate()
+        threading.Thread(target=server.serve_forever, name='coordinator', daemon=True).start()
+        print(f'Coordinator listening on {address[0] or "*"}:{server.server_address[1]}')
+
+        while not self.scheduler.finished:
+            self.expire()
+            time.sleep(1)
+        time.sleep(FINISH_GRACE_SEC)
+        server.shutdown()
+        server.server_close()
+
+
+class CoordinatorClient:
+    def __init__(self, address: Tuple[str, int], token: str = None):
+        self.address = address
+        self.token = token
+
+    def request(self, op, **kwargs) -> dict:
+        with socket.create_connection(self.address, timeout=CLAIM_TIMEOUT_SEC + 30) as sock:
+            sock.sendall((json.dumps({'op': op, 'token': self.token, **kwargs}) + '\n').encode())
+            line = sock.makefile('rb').readline()
+        if not line:
+            raise ClusterError('connection closed by the coordinator')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ClusterError(response['error'])
+        return response
+
+    def claim(self) -> dict:
+        """Returns a lease ({'id': ..., 'item': ...}) or {'id': None, 'finished': bool} if there is none (yet)."""
+        return self.request('claim')
+
+    def complete(self, lease_id, result: dict):
+        return self.request('complete', id=lease_id, result=result)
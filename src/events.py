@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Structured event log: one JSON line per check step and per check, e.g.
+
+    {"ts": "...", "event": "step", "check": "3f2a...", "party": "max", "center": "005-iz.impfterminservice.de",
+     "step": "waiting_room", "duration": 12.3, "outcome": "ok"}
+
+The lines are written by a background thread, so logging never blocks a check on disk I/O. Run this module to
+aggregate the logs into latency and failure reports per step and per center:
+
+    python events.py ../out/events.jsonl
+"""
+
+import argparse
+import datetime
+import json
+import queue
+import threading
+import uuid
+from collections import defaultdict
+
+FLUSH_INTERVAL_SEC = 1
+MAX_PENDING = 10000
+
+
+class EventLog:
+    """Appends the events to a JSON lines file, events are dropped (and counted) if the writer can't keep up."""
+
+    def __init__(self, path, flush_interval_sec=FLUSH_INTERVAL_SEC, max_pending=MAX_PENDING):
+        self.path = path
+        self.flush_interval_sec = flush_interval_sec
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self.thread.start()
+
+    def emit(self, event, **fields):
+        record = {'ts': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'event': event, **fields}
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        with open(self.path, 'a') as file:
+            while True:
+                try:
+                    records = [self.queue.get(timeout=self.flush_interval_sec)]
+                except queue.Empty:
+                    continue
+                # write everything pending at once
+                while not self.queue.empty():
+                    records.append(self.queue.get_nowait())
+
+                stop = None in records
+                file.write(''.join(json.dumps(record, default=str) + '\n' for record in records if record))
+                file.flush()
+                if stop:
+                    return
+
+
+class CheckTrace:
+    """
+    Progress notes of the current check of a worker, printed as a single line when the check is done, so the
+    output of parallel checks doesn't interleave.
+    """
+
+    def __init__(self):
+        self.check_id = None
+        self.notes = []
+
+    def start(self, prefix):
+        self.check_id = uuid.uuid4().hex[:12]
+        self.notes = [prefix]
+
+    def note(self, text):
+        self.notes.append(text)
+
+    def line(self):
+        return ' '.join(self.notes)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def read_events(paths, since=None):
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # e.g. a partially written last line
+                    continue
+                if since and record['ts'] < since:
+                    continue
+                yield record
+
+
+def aggregate(records):
+    """Returns {(event, center, step): (durations, outcomes)}, checks are reported as the step 'check'."""
+    groups = defaultdict(lambda: ([], defaultdict(int)))
+    for record in records:
+        key = (record['event'], record.get('center'), record.get('step', 'check'))
+        durations, outcomes = groups[key]
+        durations.append(record['duration'])
+        outcomes[record['outcome']] += 1
+    return groups
+
+
+def print_report(groups):
+    print(f"{'center':<40} {'step':<22} {'count':>6} {'failed':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for (event, center, step), (durations, outcomes) in sorted(groups.items(), key=lambda item: (
+            str(item[0][1]), item[0][0] == 'check', item[0][2])):
+        failed = sum(count for outcome, count in outcomes.items() if outcome != 'ok') if event == 'step' \
+            else sum(outcomes.get(outcome, 0) for outcome in ('error', 'exception', 'throttled'))
+        print(f"{str(center):<40} {step:<22} {len(durations):>6} {failed:>6} "
+              f"{percentile(durations, 50):>7.2f}s {percentile(durations, 90):>7.2f}s "
+              f"{percentile(durations, 99):>7.2f}s {max(durations):>7.2f}s")
+        if event == 'check':
+            print(f"{'':<40} {'':<22} "
+                  + ', '.join(f'{outcome}: {count}' for outcome, count in sorted(outcomes.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corona Impf-o-mat :: latency and failure report of the event log')
+    parser.add_argument('files', help="Event log file(s)", nargs='+')
+    parser.add_argument('--since', help="Only events since this ISO timestamp (UTC), e.g. 2021-05-01T12:00")
+    args = parser.parse_args()
+
+    groups = aggregate(read_events(args.files, args.since))
+    if not groups:
+        print('no events')
+        return
+    print_report(groups)
+
+
+if __name__ == '__main__':
+    main()
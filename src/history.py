@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Availability history: every check result (and the ersttermin response, if any) of each center, stored in SQLite.
+The history shows when the centers usually release new appointments, so the checks can be done more often in
+these windows and less often otherwise (see get_retry()). Run this module to print the release patterns:
+
+    python history.py ../out/history.sqlite --days 28
+"""
+
+import argparse
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from functools import lru_cache
+
+FLUSH_INTERVAL_SEC = 30
+# the release patterns are based on the last N days and updated every PROFILE_TTL_SEC
+HISTORY_DAYS = 28
+PROFILE_TTL_SEC = 60 * 60
+# the polling is only slowed down for centers with at least this many days of history
+MIN_HISTORY_DAYS = 7
+# checks outside of the release windows are done with retry * IDLE_FACTOR
+IDLE_FACTOR = 4
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+@lru_cache(maxsize=None)
+def get_tz():
+    # noinspection PyPackageRequirements
+    import dateutil.tz
+    return dateutil.tz.gettz('Europe/Berlin')
+
+
+def get_slot(timestamp: float):
+    """(weekday, hour) of the unix timestamp in local (German) time."""
+    local = datetime.datetime.fromtimestamp(timestamp, get_tz())
+    return local.weekday(), local.hour
+
+
+class ReleaseProfile:
+    """Number of releases (a check finding appointments after one that did not) per weekday and hour."""
+
+    def __init__(self, releases: dict, first_check: float):
+        self.releases = releases
+        self.first_check = first_check
+
+    def is_release_window(self, timestamp: float) -> bool:
+        """True if releases were seen in this hour or in the next one (of the same weekday)."""
+        weekday, hour = get_slot(timestamp)
+        next_weekday, next_hour = get_slot(timestamp + 60 * 60)
+        return bool(self.releases.get((weekday, hour)) or self.releases.get((next_weekday, next_hour)))
+
+    def history_days(self, now: float) -> float:
+        return (now - self.first_check) / (24 * 60 * 60)
+
+
+class HistoryStore:
+    """Append-only SQLite store of the check results, the writes are batched like the StateStore."""
+
+    def __init__(self, path, idle_factor=IDLE_FACTOR, flush_interval_sec=FLUSH_INTERVAL_SEC):
+        self.idle_factor = idle_factor
+        self.flush_interval_sec = flush_interval_sec
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.profiles = None
+        self.profiles_updated = None
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # the ersttermin responses are stored compressed, only if there is one
+        self.connection.execute('CREATE TABLE IF NOT EXISTS check_result ('
+                                'ts INTEGER, center TEXT, party TEXT, outcome TEXT, slots INTEGER, ersttermin BLOB)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS check_result_center_ts ON check_result (center, ts)')
+        self.connection.commit()
+
+    def record(self, center, party, outcome, ersttermin: dict = None, timestamp: float = None):
+        slots = None
+        data = None
+        if ersttermin is not None:
+            slots = len(ersttermin.get('termine') or []) + len(ersttermin.get('termineTSS') or [])
+            data = zlib.compress(json.dumps(ersttermin, separators=(',', ':')).encode())
+        row = (int(timestamp or time.time()), center, party, outcome, slots, data)
+
+        with self.lock:
+            self.pending.append(row)
+            if time.monotonic() - self.last_flush < self.flush_interval_sec:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.connection.executemany('INSERT INTO check_result VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+                self.connection.commit()
+                self.pending = []
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def get_profiles(self, days=HISTORY_DAYS, now: float = None) -> dict:
+        """The release profile of each center, based on the checks of the last `days` days."""
+        since = (now or time.time()) - days * 24 * 60 * 60
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT center, party, ts, outcome FROM check_result "
+                "WHERE ts >= ? AND outcome IN ('appointments', 'booked', 'no_appointments') ORDER BY ts",
+                (since,)).fetchall()
+
+        first_check = {}
+        available = {}
+        releases = defaultdict(lambda: defaultdict(int))
+        for center, party, ts, outcome in rows:
+            first_check.setdefault(center, ts)
+            is_available = outcome in ('appointments', 'booked')
+            if is_available and available.get((center, party)) is False:
+                releases[center][get_slot(ts)] += 1
+            available[(center, party)] = is_available
+
+        return {center: ReleaseProfile(dict(releases[center]), first) for center, first in first_check.items()}
+
+    def get_profile(self, center) -> ReleaseProfile:
+        """Cached release profile of the center, None without any history."""
+        now = time.monotonic()
+        if self.profiles is None or now - self.profiles_updated > PROFILE_TTL_SEC:
+            self.flush()
+            self.profiles = self.get_profiles()
+            self.profiles_updated = now
+        return self.profiles.get(center)
+
+    def get_retry(self, center, retry, now: float = None) -> float:
+        """
+        The retry interval of the center at this time: `retry` in (or right before) the usual release windows,
+        retry * idle_factor outside of them. Centers with too little history are always checked every `retry`.
+        """
+        now = now or time.time()
+        profile = self.get_profile(center)
+        if profile is None or profile.history_days(now) < MIN_HISTORY_DAYS or profile.is_release_window(now):
+            return retry
+        return retry * self.idle_factor
+
+
+def print_report(store: HistoryStore, days, center=None):
+    with store.lock:
+        rows = store.connection.execute(
+            'SELECT center, outcome, COUNT(*), AVG(slots) FROM check_result WHERE ts >= ? GROUP BY center, outcome',
+            (time.time() - days * 24 * 60 * 60,)).fetchall()
+    summary = defaultdict(dict)
+    for row_center, outcome, count, slots in rows:
+        summary[row_center][outcome] = (count, slots)
+
+    for name, profile in sorted(store.get_profiles(days).items()):
+        if center and name != center:
+            continue
+        outcomes = ', '.join(f'{outcome}: {count}' + (f' (avg. {slots:.1f} slots)' if slots else '')
+                             for outcome, (count, slots) in sorted(summary[name].items()))
+        print(f'{name} ({profile.history_days(time.time()):.1f} days, {outcomes})')
+        print('releases  ' + ''.join(f'{hour:>3}' for hour in range(24)))
+        for weekday, weekday_name in enumerate(WEEKDAYS):
+            print(f'{weekday_name:<10}' + ''.join(f'{profile.releases.get((weekday, hour), 0) or ".":>3}'
+                                                   for hour in range(24)))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corona Impf-o-mat :: release patterns per center, weekday and hour')
+    parser.add_argument('file', help="History database, see --history of main.py")
+    parser.add_argument('--days', help="Analyze the last N days", type=int, default=HISTORY_DAYS)
+    parser.add_argument('--center', help="Only this center (host), e.g. 005-iz.impfterminservice.de")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.file)
+    print_report(store, args.days, args.center)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,100 @@
 #!/usr/bin/env python3
 
+import time
+
+# see the startup report in main()
+START_TIME = time.monotonic()
+
 import argparse
-from dataclasses import dataclass, is_dataclass
-from typing import List
+import functools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, is_dataclass, replace
+from typing import TYPE_CHECKING, List, Tuple
 
-from selenium import webdriver
-import time
 import sys
 import datetime
 import os
 import glob
-import boto3
-# noinspection PyPackageRequirements
-import dateutil.tz
 import yaml
 
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-
-from selenium.webdriver.chrome.webdriver import WebDriver
 import json
-from pyvirtualdisplay import Display
 import re
+import signal
+import threading
 from enum import Enum
 
-screenshot_index = 1
-display: Display
+from api import RADIUS, ApiClient, ApiError, get_host, get_vaccine_codes, has_appointments
+from artifacts import ArtifactStore
+from booking import BookingError, book, get_missing_fields
+from cache import ResponseCache
+from cluster import ClusterError, Coordinator, CoordinatorClient, RECONNECT_SEC, is_loopback, parse_address
+from events import CheckTrace, EventLog
+from history import HistoryStore, get_tz
+import metrics
+from scheduler import Scheduler
+from screenshots import ScreenshotRing, remove_files
+from session import SessionStore, get_js_heap_size
+from state import StateStore
+from profiler import CommandProfiler, ProfiledWebDriver
+from notify import Dispatcher, Notification, SesTransport, StubTransport, read_attachments
+from network import NetworkMonitor, enable_performance_log
+from page import PageSnapshot, PageState
+from waits import StepTimer, TIMEOUTS, wait_until, xhr_idle, all_of, page_contains, page_not_contains, \
+    title_not_contains, element_present, element_absent
+
+# selenium and pyvirtualdisplay are only imported when a browser is started, see setup_browser() and start_display()
+if TYPE_CHECKING:
+    from pyvirtualdisplay import Display
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+display: 'Display'
+notifier: Dispatcher
+state_store: StateStore = None
+session_store: SessionStore = None
+event_log: EventLog = None
+history_store: HistoryStore = None
+response_cache: ResponseCache = None
+profiler: CommandProfiler = None
 
-# SES and mail configuration
-SENDER = os.environ.get('SENDER')
-AWS_REGION = os.environ.get('SES_AWS_REGION')
-CHARSET = "UTF-8"
 OUT_PATH = "../out"
 
+artifacts = ArtifactStore(OUT_PATH)
+
+# URL patterns blocked by the browser per resource type, see BrowserConfig.block
+BLOCKED_URL_PATTERNS = {
+    'fonts': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'scripts': ['*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+                '*hotjar.com*', '*etracker.com*'],
+}
+
+# lower bounds of the age brackets (see the priority groups of the Coronavirus-Impfverordnung), parties without
+# a code are grouped by these
+AGE_BRACKETS = (18, 60, 70, 80)
+
+# process.js actions fetched by fetch_json_data() and the files they are written to
+JSON_DATA_FILES = {
+    'get_ersttermin_json': 'ersttermin.json',
+    'get_vaccination_list_json': 'vaccination-list.json',
+    'get_version': 'version.txt',
+}
+
+_RUN_PROCESS_ACTION_JS = """
+const done = arguments[arguments.length - 1];
+if (!window.impfomat) {
+    done({installed: false});
+} else {
+    window.impfomat.run(arguments[0], arguments[1]).then(done, done);
+}
+"""
+
+# the config file is checked for modifications every N seconds (or reloaded on SIGHUP)
+CONFIG_POLL_SEC = 10
+
+# default pacing per worker of the checks against the same host
+PARTY_DELAY_SEC = 10
+API_PARTY_DELAY_SEC = 1
+
 
 # see https://stackoverflow.com/questions/51564841/creating-nested-dataclass-objects-in-python
 def nested_dataclass(*args, **kwargs):
@@ -95,6 +156,11 @@ class Party:
     postal_code: str = None
     age: int = None
     vaccine_code: str = None
+    # book the first appointment right away (code flow only, needs the complete address), see booking.py
+    auto_book: bool = False
+    # further centers (urls) checked concurrently with url and the search radius in km (api engine only)
+    centers: List[str] = None
+    radius: int = None
     last_check_timestamp: datetime.datetime = None
     last_check_success: bool = None
     status: ScheduleStatus = ScheduleStatus.init
@@ -120,6 +186,89 @@ class Party:
     def identifier(self):
         return re.sub('[^a-z]', '_', self.name.lower())
 
+    @property
+    def api_checkable(self) -> bool:
+        """
+        The ersttermin endpoint needs the code (as authorization) and the vaccine code, the parties without them are
+        always checked in the browser (see process_api()).
+        """
+        return bool(self.code and self.vaccine_code)
+
+    @property
+    def urls(self) -> List[str]:
+        """The url of the center and the further centers, if any."""
+        return [self.url] + [url for url in self.centers or [] if url != self.url]
+
+    @property
+    def group_key(self):
+        """Parties with the same key share the same check (and the same result)."""
+        # the booking is done for the group, so the parties booking automatically are checked on their own
+        search = tuple(self.urls), str(self.postal_code), self.vaccine_code, self.radius, self.auto_book
+        if self.code:
+            return search + (self.code,)
+        return search + (get_age_bracket(self.age),)
+
+    def get_config(self) -> dict:
+        """The configured fields (see config.yml), e.g. to create the party on a cluster worker."""
+        return {
+            'name': self.name,
+            'recipient': self.recipient,
+            'address': asdict(self.address),
+            'url': self.url,
+            'code': self.code,
+            'postal_code': self.postal_code,
+            'age': self.age,
+            'vaccine_code': self.vaccine_code,
+            'auto_book': self.auto_book,
+            'centers': self.centers,
+            'radius': self.radius,
+        }
+
+    def get_state(self) -> dict:
+        return {
+            'status': self.status.value,
+            'last_check_timestamp': self.last_check_timestamp.isoformat() if self.last_check_timestamp else None,
+            'last_check_success': self.last_check_success,
+            'error_notification_sent': self.error_notification_sent,
+            'last_error': str(self.last_error) if self.last_error else None,
+        }
+
+    def restore_state(self, state: dict):
+        self.status = ScheduleStatus(state['status'])
+        if state['last_check_timestamp']:
+            self.last_check_timestamp = datetime.datetime.fromisoformat(state['last_check_timestamp'])
+        if state['last_check_success'] is not None:
+            self.last_check_success = bool(state['last_check_success'])
+        self.error_notification_sent = bool(state['error_notification_sent'])
+        if state['last_error']:
+            self.last_error = Error(state['last_error'])
+
+
+@dataclass
+class PartyGroup:
+    """Parties sharing the same center, postal code and code (or age bracket), see Party.group_key."""
+    parties: List[Party]
+    # False once the group has been replaced or removed by a reload of the configuration
+    active: bool = True
+
+    @property
+    def url(self):
+        return self.parties[0].url
+
+    def get_next_check_delay(self, retry: int) -> float:
+        return min(get_next_check_delay(party, retry) for party in self.parties)
+
+
+@dataclass
+class BrowserConfig:
+    headless: bool = False
+    window_size: Tuple[int, int] = (923, 1011)
+    # resources not loaded by the browser: images, fonts and (third-party) scripts
+    block: Tuple[str, ...] = ('images',)
+
+
+browser_config = BrowserConfig()
+
 
 class Error(Exception):
     """Base class for exceptions in this module."""
@@ -130,69 +279,90 @@ class ErrorAlreadyScheduled(Exception):
     pass
 
 
-def create_multipart_message(
-        sender: str, recipients: list, title: str, text: str = None, html: str = None, attachments: list = None) \
-        -> MIMEMultipart:
-    """
-    Creates a MIME multipart message object.
-    Uses only the Python `email` standard library.
-    Emails, both sender and recipients, can be just the email string or have the format 'The Name <the_email@host.com>'.
-
-    :param sender: The sender.
-    :param recipients: List of recipients. Needs to be a list, even if only one recipient.
-    :param title: The title of the email.
-    :param text: The text version of the email body (optional).
-    :param html: The html version of the email body (optional).
-    :param attachments: List of files to attach in the email.
-    :return: A `MIMEMultipart` to be used to send the email.
-    """
-    multipart_content_subtype = 'alternative' if text and html else 'mixed'
-    msg = MIMEMultipart(multipart_content_subtype)
-    msg['Subject'] = title
-    msg['From'] = sender
-    msg['To'] = ', '.join(recipients)
-
-    # Record the MIME types of both parts - text/plain and text/html.
-    # According to RFC 2046, the last part of a multipart message, in this case the HTML message, is best and preferred.
-    if text:
-        part = MIMEText(text, 'plain')
-        msg.attach(part)
-    if html:
-        part = MIMEText(html, 'html')
-        msg.attach(part)
-
-    # Add attachments
-    for attachment in attachments or []:
-        with open(attachment, 'rb') as f:
-            part = MIMEApplication(f.read())
-            part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(attachment))
-            msg.attach(part)
-
-    return msg
-
-
-def send_mail(recipient: str, title: str, text: str = None, html: str = None, attachments: list = None) -> dict:
-    """
-    Send email to recipients. Sends one mail to all recipients.
-    The sender needs to be a verified email in SES.
-    """
+class ErrorThrottled(Error):
+    """The site responded with 429 (too many requests)."""
+    pass
 
-    text += """
 
--- 
-Corona Impf-o-mat
-"""
-    msg = create_multipart_message(SENDER, [recipient], title, text, html, attachments)
-    ses_client = boto3.client('ses')  # Use your settings here
-    print(f'will send an email to {recipient} from {SENDER}')
-    return ses_client.send_raw_email(
-        Source=SENDER,
-        Destinations=[recipient],
-        RawMessage={'Data': msg.as_string()}
-    )
+@dataclass
+class Worker:
+    """Per-worker context, each worker owns an isolated browser session."""
+    id: int
+    browser: 'WebDriver' = None
+    screenshots: ScreenshotRing = field(default_factory=ScreenshotRing)
+    network: NetworkMonitor = field(default_factory=NetworkMonitor)
+    # only set when using the "api" check engine
+    api: ApiClient = None
+    timer: StepTimer = field(default_factory=StepTimer)
+    trace: CheckTrace = field(default_factory=CheckTrace)
+    # result of the last check, see check_group(), and the ersttermin response it is based on (if any)
+    outcome: str = None
+    ersttermin: dict = None
+    # url of the center the appointments were found at, if it is not the one of the party (see Party.centers)
+    center: str = None
+    # cached snapshot of the current page state, see page()
+    page_snapshot: PageSnapshot = None
+    # number of checks done by the current browser session, the session is recycled after recycle_after checks
+    # or if the JS heap exceeds recycle_memory_mb (0 to disable). The api engine polls without the browser, these
+    # checks do not count (see browser_used).
+    checks: int = 0
+    browser_used: bool = False
+    recycle_after: int = 0
+    recycle_memory_mb: int = 0
+
+    def page(self) -> PageSnapshot:
+        """Returns the snapshot of the current page, fetching the page source only once per page state."""
+        if self.page_snapshot is None:
+            self.page_snapshot = PageSnapshot.capture(self.browser)
+        return self.page_snapshot
+
+    def invalidate_page(self):
+        self.page_snapshot = None
+
+    def begin_check(self, party: 'Party'):
+        self.screenshots.clear()
+        self.timer.reset()
+        self.trace.start(f'[{party.name}] #{party.status.value}')
+        self.outcome = None
+        self.ersttermin = None
+        self.center = None
+        self.browser_used = False
+        if isinstance(self.browser, ProfiledWebDriver):
+            self.browser.bind(party.identifier, self.timer)
+        if profiler:
+            profiler.start_python()
+
+    def wait(self, condition, timeout, **kwargs) -> bool:
+        """Waits for a DOM condition, the page snapshot is outdated afterwards."""
+        self.invalidate_page()
+        return wait_until(self.browser, condition, timeout, **kwargs)
+
+    def needs_recycle(self) -> bool:
+        if self.recycle_after and self.checks >= self.recycle_after:
+            return True
+        return bool(self.recycle_memory_mb) and get_js_heap_size(self.browser) > self.recycle_memory_mb * 1024 * 1024
+
+    def restart_browser(self, reason):
+        """Replaces the browser by a new one, the saved sessions will be restored."""
+        metrics.BROWSER_RESTARTS.inc(reason=reason)
+        self.browser.quit()
+        self.browser = setup_browser()
+        self.network = NetworkMonitor()
+        self.invalidate_page()
+        self.checks = 0
+
+
+def send_mail(recipient: str, title: str, text: str = None, html: str = None, attachments: list = None):
+    """
+    Queues a mail to the recipient, the notification dispatcher will send it in the background.
+    The attachments are read right away, so the files can be removed after this call.
+    """
+    notifier.notify(Notification(recipient, title, text, html, read_attachments(attachments)))
 
 
 def start_display():
+    from pyvirtualdisplay import Display
+
     global display
     display = Display(visible=True, size=(800, 600), backend="xvfb")
     display.start()
@@ -202,16 +372,20 @@ def stop_display():
     display.stop()
 
 
-def set_chrome_options():
+def set_chrome_options(config: BrowserConfig):
     """Sets chrome options for Selenium.
-    Chrome options for headless browser is enabled.
+    With config.headless Chrome's new headless mode is used, no X server needed.
     """
+    from selenium import webdriver
+
     chrome_options = webdriver.ChromeOptions()
-    # chrome_options.add_argument("--headless")
+    if config.headless:
+        chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_argument("window-size=923,1011")
+    chrome_options.add_argument(f"window-size={config.window_size[0]},{config.window_size[1]}")
+    # the user agent is always set explicitly, so the headless mode is not revealed ("HeadlessChrome")
     user_agent = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.72 " \
                  "Safari/537.36 "
     chrome_options.add_argument(f'user-agent={user_agent}')
@@ -220,22 +394,32 @@ def set_chrome_options():
     chrome_options.experimental_options["prefs"] = chrome_prefs
     chrome_options.experimental_options["excludeSwitches"] = ["enable-automation"]
     chrome_options.experimental_options["useAutomationExtension"] = False
-    chrome_prefs["profile.default_content_settings"] = {"images": 2}
+    # network events (incl. the status codes) are read from the performance log, see network.py
+    enable_performance_log(chrome_options)
+
+    if 'images' in config.block:
+        chrome_prefs["profile.default_content_settings"] = {"images": 2}
+        chrome_prefs["profile.managed_default_content_settings"] = {"images": 2}
     return chrome_options
 
 
-def screenshot(_browser, filename=None):
-    global screenshot_index
+def screenshot(worker: Worker, party: Party, filename=None):
+    """Takes a screenshot into the in-memory ring of the worker, see write_screenshot_files()."""
     if filename is None:
-        filename = f'screenshot_{screenshot_index}'
+        filename = f'screenshot_{party.identifier}_{worker.screenshots.index}'
 
-    _browser.save_screenshot(f'{OUT_PATH}/{filename}.png')
-    screenshot_index += 1
+    worker.screenshots.capture(worker.browser, filename)
 
 
 def get_timestamp():
-    tz = dateutil.tz.gettz('Europe/Berlin')
-    return datetime.datetime.now(tz)
+    return datetime.datetime.now(get_tz())
+
+
+def get_age_bracket(age):
+    """Returns the lower bound of the age bracket, the age form gives the same result within a bracket."""
+    if age is None:
+        return None
+    return max([bound for bound in AGE_BRACKETS if bound <= age], default=0)
 
 
 def get_url(code, postal_code, url):
@@ -246,132 +430,301 @@ def get_url(code, postal_code, url):
 
 
 def write_file(filename, text):
-    file = open(f'{OUT_PATH}/{filename}', 'w')
-    file.write(text)
-    file.close()
+    """Writes the file to OUT_PATH (atomically), unless it already has this content."""
+    artifacts.write(filename, text)
+
+
+def log_check(worker: Worker, party: Party, members: List[Party], outcome: str, duration: float):
+    """Prints the progress of the check as a single line and writes its steps and result to the event log."""
+    summary = f' | {worker.timer.summary()} (total={worker.timer.total():.1f}s)' if worker.timer.steps else ''
+    print(f'{worker.trace.line()}{summary}')
+    if not event_log:
+        return
+
+    fields = {
+        'check': worker.trace.check_id,
+        'party': party.identifier,
+        'center': get_host(worker.center or party.url),
+        'worker': worker.id,
+    }
+    for name, step_duration, step_outcome in worker.timer.steps:
+        event_log.emit('step', **fields, step=name, duration=round(step_duration, 3), outcome=step_outcome)
+    event_log.emit('check', **fields, duration=round(duration, 3), outcome=outcome,
+                   members=[member.identifier for member in members])
+
+
+def record_metrics(party: Party, timer: StepTimer, duration: float, throttled: bool):
+    host = get_host(party.url)
+    for name, step_duration, _ in timer.steps:
+        metrics.STEP_DURATION.observe(step_duration, host=host, step=name)
+    metrics.CHECK_DURATION.observe(duration, host=host)
+    metrics.CHECKS.inc(host=host, status=party.status.value)
+    if throttled:
+        metrics.THROTTLED.inc(host=host)
+
+
+@functools.lru_cache(maxsize=None)
+def get_process_script():
+    with open(os.path.join(os.path.dirname(__file__), 'process.js')) as file:
+        return file.read()
 
 
-def get_process_script():
-    file = open(f'process.js')
-    content = file.read()
-    file.close()
-    return content
+def run_process_action(_browser: 'WebDriver', action, args=None):
+    """
+    Runs an action of process.js in the current page. The script is installed on the first action in a document,
+    later actions in the same document do not send it again.
+    """
+    result = _browser.execute_async_script(_RUN_PROCESS_ACTION_JS, action, args)
+    if isinstance(result, dict) and result.get('installed') is False:
+        _browser.execute_script(get_process_script())
+        result = _browser.execute_async_script(_RUN_PROCESS_ACTION_JS, action, args)
+    return result
+
+
+def fetch_json_data(_browser: 'WebDriver'):
+    """
+    Fetches the ersttermin data and, unless cached for the current site version, the vaccination list and the
+    version in parallel (a single round trip).
+    """
+    host = get_host(_browser.current_url)
+    actions = ['get_ersttermin_json']
+    if not response_cache or response_cache.needs_version_check(host) \
+            or response_cache.get(host, 'vaccination-list') is None:
+        actions += ['get_version', 'get_vaccination_list_json']
+
+    results = run_process_action(_browser, 'batch', actions)
+    for action in actions:
+        output = results[action]
+        write_file(JSON_DATA_FILES[action], output if isinstance(output, str) else json.dumps(output))
+
+    # errors are returned as objects
+    if response_cache and isinstance(results.get('get_version'), str):
+        response_cache.update_version(host, results['get_version'])
+        if isinstance(results.get('get_vaccination_list_json'), str):
+            response_cache.put(host, 'vaccination-list', json.loads(results['get_vaccination_list_json']))
+
+
+def check_vaccine_code(party: Party, vaccination_list: list = None):
+    """
+    Raises an Error if the vaccine code of the party is not in the vaccination list of the center, by default the
+    cached one (nothing is checked if there is none).
+    """
+    if vaccination_list is None and response_cache:
+        vaccination_list = response_cache.get(get_host(party.url), 'vaccination-list')
+    if not party.vaccine_code or vaccination_list is None:
+        return
+
+    unknown = set(party.vaccine_code.split(',')) - get_vaccine_codes(vaccination_list)
+    if unknown:
+        raise Error(f'unknown vaccine code(s) {", ".join(sorted(unknown))}, see {party.url}'
+                    f'assets/static/its/vaccination-list.json')
 
 
-def fetch_json_data(_browser: WebDriver):
-    output = _browser.execute_async_script(get_process_script(), 'get_ersttermin_json')
-    write_file('ersttermin.json', output)
+def check_429(worker: Worker):
+    """Raises ErrorThrottled if any response since the start of the check had the status 429."""
+    if worker.network.poll(worker.browser).throttled():
+        raise ErrorThrottled(f'got 429 error')
 
-    output = _browser.execute_async_script(get_process_script(), 'get_vaccination_list_json')
-    write_file('vaccination-list.json', output)
 
-    output = _browser.execute_async_script(get_process_script(), 'get_version')
-    write_file('version.txt', output)
+def get_search_result(worker: Worker):
+    """
+    Returns whether the last /rest/suche/ response of the page reported appointments, None if there is no usable
+    response (the page text is the fallback then).
+    """
+    response = worker.network.poll(worker.browser).last('/rest/suche/')
+    if response is None:
+        return None
+    if response.status == 429:
+        raise ErrorThrottled(f'got 429 response from {response.url}')
+    if response.status != 200:
+        return None
 
+    from selenium.common.exceptions import WebDriverException
 
-def check_429():
-    console = json.dumps(browser.get_log('browser'))
-    if "429" in console:
-        # driver.execute_script("return localStorage.setItem('nfa-show-cinfo-20201110-VP1246', true)")
-        write_file('console.log', console)
-        raise Error(f'got 429 error')
+    try:
+        data = json.loads(worker.network.get_body(worker.browser, response))
+    except (WebDriverException, ValueError):
+        return None
+    if not isinstance(data, dict) or ('termine' not in data and 'termineTSS' not in data):
+        return None
+    worker.ersttermin = data
+    return has_appointments(data)
 
 
-def get_last_browser_error():
-    logs = [log for log in browser.get_log('browser') if log['level'] == "SEVERE"]
+def get_last_browser_error(_browser: 'WebDriver'):
+    logs = [log for log in _browser.get_log('browser') if log['level'] == "SEVERE"]
     if len(logs) == 0:
         return None
     return logs.pop()['message']
 
 
-def dismiss_cookie_banner():
-    global browser
-    if "Cookie Hinweis" in browser.page_source:
-        browser.find_element_by_class_name("cookies-info-close").click()
-        print('(accept cookies) ', end='')
-        time.sleep(2)
-        screenshot(browser)
+def load_page(worker: Worker, url):
+    browser = worker.browser
+    with worker.timer.step('load'):
+        browser.get(url)
+        worker.wait(xhr_idle, TIMEOUTS['load'])
+
+
+def dismiss_cookie_banner(worker: Worker, party: Party):
+    browser = worker.browser
+    if worker.page().cookie_banner:
+        with worker.timer.step('cookie_banner'):
+            browser.find_element_by_class_name("cookies-info-close").click()
+            worker.trace.note('(accept cookies)')
+            worker.wait(element_absent('.cookies-info-close'), TIMEOUTS['cookie_banner'])
+        screenshot(worker, party)
+
+
+def wait_for_waiting_room(worker: Worker, party: Party):
+    if worker.page().state == PageState.waiting_room:
+        timeout_sec = TIMEOUTS['waiting_room']
+        start = time.monotonic()
+        with worker.timer.step('waiting_room'):
+            if not worker.wait(page_not_contains("Virtueller Warteraum"), timeout_sec, poll_frequency=1):
+                raise Error(f'Timeout in the "Virtueller Warteraum" step has occurred (timeout={timeout_sec}s)')
+            worker.wait(xhr_idle, TIMEOUTS['load'])
+
+        screenshot(worker, party)
+        worker.trace.note(f'(virtual delay, {time.monotonic() - start:.0f} sec)')
+
+
+def bootstrap_api(worker: Worker, party: Party, url=None):
+    """Uses the browser once to pass the waiting room (of url, by default the party's center), the HTTP client will
+    then reuse the cookies."""
+    browser = worker.browser
+    worker.browser_used = True
+    url = url or party.url
+    worker.trace.note(f'(bootstrap {get_host(url)})' if url != party.url else '(bootstrap)')
+    load_page(worker, get_url(code=party.code, postal_code=party.postal_code, url=url))
+    dismiss_cookie_banner(worker, party)
+    wait_for_waiting_room(worker, party)
+    worker.api.bootstrap(browser, url)
+    # the browser is idle from now on, so drop the network events collected so far
+    worker.network.clear(browser)
+
+
+def process_api(worker: Worker, party: Party):
+    """
+    Polls the ersttermin REST endpoint (of all centers of the party concurrently, the first one having appointments
+    wins), the browser flow is only used if there are appointments available.
+    """
+    # the further centers are not rate limited by the scheduler, a failing one is skipped while it cools down
+    # instead of being bootstrapped again with every check
+    if not worker.api.is_bootstrapped(party.url):
+        bootstrap_api(worker, party)
+    further = []
+    for url in party.urls[1:]:
+        if worker.api.is_cooling_down(url):
+            continue
+        if not worker.api.is_bootstrapped(url):
+            try:
+                bootstrap_api(worker, party, url)
+            except Error as e:
+                worker.trace.note(f'({get_host(url)}: {e}, cool down for {worker.api.throttle(url):.0f}s)')
+                continue
+        further.append(url)
+
+    try:
+        with worker.timer.step('api'):
+            # cached, so usually without any request
+            check_vaccine_code(party, worker.api.get_vaccination_list(party.url))
+            center, results = worker.api.get_first_ersttermin([party.url] + further, party.postal_code,
+                                                              party.vaccine_code, party.code, party.radius or RADIUS)
+        for url in further:
+            if isinstance(results.get(url), ApiError):
+                worker.trace.note(f'({get_host(url)}: {results[url]}, cool down for {worker.api.throttle(url):.0f}s)')
+            elif url in results:
+                worker.api.reset_throttle(url)
+
+        # without appointments, the result is the one of the party's center
+        ersttermin = results[center or party.url]
+        if isinstance(ersttermin, ApiError):
+            raise ersttermin
+    except ApiError as e:
+        if e.status == 429:
+            raise ErrorThrottled(f'REST API error: {e}')
+        raise Error(f'REST API error: {e}')
+    worker.ersttermin = ersttermin
+
+    if center is None:
+        worker.trace.note('(api) => no appointments available')
+        return False
+
+    write_file(f'ersttermin_{party.identifier}.json', json.dumps(ersttermin))
+    if center == party.url:
+        worker.trace.note('(api) appointments available, verifying using the browser')
+        return process(worker, party)
+
+    worker.center = center
+    worker.trace.note(f'(api) appointments available at {get_host(center)}, verifying using the browser')
+    return process(worker, replace(party, url=center))
 
 
-def process(party):
-    global browser
+def process(worker: Worker, party: Party):
+    browser = worker.browser
+    worker.browser_used = True
 
     # chrome_options = set_chrome_options()
     # driver = webdriver.Chrome(options=chrome_options)
 
     web_url = get_url(code=party.code, postal_code=party.postal_code, url=party.url)
 
-    print(f'[{party.name}] #{party.status.value}', end=' ', flush=True)
+    # only if the vaccination list of the center is cached, no request is done
+    check_vaccine_code(party)
 
-    browser.get(web_url)
-
-    time.sleep(1)
+    worker.network.clear(browser)
+    load_page(worker, web_url)
+    check_429(worker)
 
     # we will take screenshots from time to time, this being the initial one
-    screenshot(browser)
+    screenshot(worker, party)
 
-    dismiss_cookie_banner()
+    dismiss_cookie_banner(worker, party)
 
     # check if the page is currently in maintenance mode
-    if "Wartungsarbeiten" in browser.page_source:
-        print('site is currently in maintenance mode')
+    if worker.page().state == PageState.maintenance:
+        worker.trace.note('site is currently in maintenance mode')
         return False
 
-    dismiss_cookie_banner()
-
-    if "Virtueller Warteraum" in browser.page_source:
-        timeout_sec = 900
-        step = 3
-        elapsed = 0
-        timeout_after = datetime.datetime.now() + datetime.timedelta(seconds=timeout_sec)
-        while "Virtueller Warteraum" in browser.page_source:
-            time.sleep(step)
-            elapsed += step
-            if datetime.datetime.now() > timeout_after:
-                raise Error(f'Timeout in the "Virtueller Warteraum" step has occurred (timeout={timeout_sec}s)')
+    dismiss_cookie_banner(worker, party)
 
-        screenshot(browser)
-        print(f'(virtual delay, {elapsed} sec) ', end='')
+    wait_for_waiting_room(worker, party)
 
-    dismiss_cookie_banner()
+    dismiss_cookie_banner(worker, party)
 
     if party.code:
         # check if the challenge validation page is the current one (this should be the case, anyway)
-        if "Challenge Validation" in browser.title:
-            timeout_sec = 60
-            timeout_after = datetime.datetime.now() + datetime.timedelta(seconds=timeout_sec)
+        if worker.page().state == PageState.challenge_validation:
+            timeout_sec = TIMEOUTS['challenge_validation']
             # wait for the "processing" page to disappear (we will be redirected to somewhere else after 30s
-            while "Challenge Validation" in browser.title:
-                print('.', end='')
-                time.sleep(3)
-                if datetime.datetime.now() > timeout_after:
+            with worker.timer.step('challenge_validation'):
+                if not worker.wait(title_not_contains("Challenge Validation"), timeout_sec, poll_frequency=1):
                     raise Error(f'Timeout in the "Challenge Validation" step has occurred (timeout={timeout_sec}s)')
+                worker.wait(xhr_idle, TIMEOUTS['load'])
 
-            screenshot(browser)
-            print(' ', end='')
+            screenshot(worker, party)
 
-        dismiss_cookie_banner()
+        dismiss_cookie_banner(worker, party)
 
-        if browser.current_url == f"{party.url}impftermine":
-            time.sleep(2)
-            browser.get(web_url)
-            print(f'(reload) ', end='')
-            time.sleep(1)
-            screenshot(browser)
+        if worker.page().url == f"{party.url}impftermine":
+            load_page(worker, web_url)
+            worker.trace.note('(reload)')
+            screenshot(worker, party)
 
-        if browser.current_url == f"{party.url}impftermine":
-            raise Error(f'Unable to access the page {web_url}, being redirected to {browser.current_url}')
+        page = worker.page()
+        if page.url == f"{party.url}impftermine":
+            raise Error(f'Unable to access the page {web_url}, being redirected to {page.url}')
 
         # check if there is already an appointment scheduled for this code
-        if "Ihr Termin am" in browser.page_source:
+        if page.state == PageState.already_scheduled:
             for h2 in browser.find_elements_by_css_selector('h2.ets-booking-headline'):
-                print(f'({h2.text}) ', end='')
+                worker.trace.note(f'({h2.text})')
             raise ErrorAlreadyScheduled(f'appointment already scheduled')
 
-        dismiss_cookie_banner()
+        dismiss_cookie_banner(worker, party)
 
         # now we should see a page with a "wählen Sie bitte ein Terminpaar für Ihre Corona-Schutzimpfung" text
-        if "Termine suchen" not in browser.page_source:
+        if "Termine suchen" not in worker.page():
             raise Error(f'was expecting to see "Termine suchen" but this string was not found')
 
         # noinspection PyBroadException
@@ -379,67 +732,72 @@ def process(party):
             browser.find_element_by_css_selector("button.search-filter-button").click()
 
         except Exception:
-            print(f'parsing error (button.search-filter-button not found)')
+            worker.trace.note('parsing error (button.search-filter-button not found)')
             return False
 
-        time.sleep(5)
-        screenshot(browser)
+        # wait for the search to finish, a timeout is reported below ("Termine werden gesucht")
+        with worker.timer.step('search'):
+            worker.wait(all_of(xhr_idle, page_not_contains("Termine werden gesucht")), TIMEOUTS['search'])
+        screenshot(worker, party)
 
         # dismiss the cookie banner, else we will not be able to click on stuff behind it
-        if "Cookie Hinweis" in browser.page_source:
-            browser.find_element_by_class_name("cookies-info-close").click()
-            time.sleep(1)
-            screenshot(browser)
+        dismiss_cookie_banner(worker, party)
 
-        print('=> ', end='')
+        worker.trace.note('=>')
 
-        screenshot(browser)
+        screenshot(worker, party)
 
-        if "leider keine Termine" in browser.page_source:
-            print(f'no appointments available')
+        # the search response tells exactly if there are appointments, the page text is just the fallback
+        available = get_search_result(worker)
+        page = worker.page()
+        if available is False or (available is None and page.state == PageState.no_appointments):
+            worker.trace.note('no appointments available')
             return False
 
-        elif "Termine werden gesucht" in browser.page_source:
-            print(f'timeout')
+        elif available is None and page.state == PageState.searching:
+            worker.trace.note('timeout')
             return False
 
         else:
-            print(f'success: at least one appointment found.')
-            write_file('form.html', browser.page_source)
+            worker.trace.note('success: at least one appointment found.')
+            write_file(f'form_{party.identifier}.html', page.source)
 
             return True
 
     else:
-        if browser.current_url == f"{party.url}impftermine":
-            print(f'(reload) ', end='')
-            browser.get(web_url)
-            time.sleep(1)
-            screenshot(browser)
+        if worker.page().url == f"{party.url}impftermine":
+            worker.trace.note('(reload)')
+            load_page(worker, web_url)
+            screenshot(worker, party)
 
-        if browser.current_url == f"{party.url}impftermine":
-            raise Error(f'Unable to access the page {web_url}, being redirected to {browser.current_url}')
+        page = worker.page()
+        if page.url == f"{party.url}impftermine":
+            raise Error(f'Unable to access the page {web_url}, being redirected to {page.url}')
 
         # now we should see a page with a "Wurde Ihr Anspruch auf .." text
-        if "Wurde Ihr Anspruch" not in browser.page_source:
+        if "Wurde Ihr Anspruch" not in page:
             raise Error(f'was expecting to see "Wurde Ihr Anspruch" but this string was not found')
 
         # click on "Nein"
         browser.find_element_by_css_selector('app-corona-vaccination > div:nth-child(2) > div > div > '
                                              'label:nth-child(2) > span').click()
-        # wait some time
-        time.sleep(10)
-        screenshot(browser)
+        # wait for either the "no appointments" message or the age form
+        with worker.timer.step('claim'):
+            worker.wait(all_of(xhr_idle, page_contains("Es wurden keine freien", "Gehören Sie")),
+                        TIMEOUTS['age_form'])
+        screenshot(worker, party)
 
-        print('=> ', end='')
+        worker.trace.note('=>')
 
-        if "Es wurden keine freien" in browser.page_source:
-            print(f'no appointments available (1)')
+        page = worker.page()
+        if page.state == PageState.no_appointments:
+            worker.trace.note('no appointments available (1)')
             return False
 
-        if "Folgende Personen" not in browser.page_source:
+        if "Folgende Personen" not in page:
             raise Error(f'was expecting to see "Folgende Personen" but this string was not found')
 
-        if "Gehören Sie" not in browser.page_source:
+        if "Gehören Sie" not in page:
             raise Error(f'was expecting to see "Gehören Sie..." but this string was not found')
 
         browser.find_element_by_css_selector('app-corona-vaccination > div:nth-child(3) > div > div > div > '
@@ -448,30 +806,33 @@ def process(party):
                                              'label:nth-child(1) > span').click()
 
         age_str = f'{party.age}'
-        browser.find_element_by_xpath(f"//input[@name='age']").send_keys(age_str)
-        time.sleep(2)
-        screenshot(browser)
+        with worker.timer.step('age_form'):
+            worker.wait(element_present("input[name='age']"), TIMEOUTS['age_form'])
+            browser.find_element_by_xpath(f"//input[@name='age']").send_keys(age_str)
+            worker.wait(xhr_idle, TIMEOUTS['age_form'])
+        screenshot(worker, party)
 
         browser.find_element_by_css_selector('app-corona-vaccination-no > form > div:nth-child(4) > button').click()
-        time.sleep(1)
-        screenshot(browser)
-
-        if "Es wurden keine freien Termine" in browser.page_source:
-            print(f'no appointments available (2)')
+        with worker.timer.step('submit'):
+            worker.wait(xhr_idle, TIMEOUTS['search'])
+        screenshot(worker, party)
+
+        available = get_search_result(worker)
+        page = worker.page()
+        if available is False or (available is None and "Es wurden keine freien Termine" in page):
+            worker.trace.note('no appointments available (2)')
             return False
 
-        write_file('page.html', browser.page_source)
-        print(f'Success: saved page source to page.html..')
+        write_file(f'page_{party.identifier}.html', page.source)
+        worker.trace.note(f'Success: saved page source to page_{party.identifier}.html..')
         return True
 
 
-def remove_screenshot_files():
-    global screenshot_index
-
-    files = glob.glob(f'f{OUT_PATH}/screenshot_*.*')
-    for f in files:
-        os.remove(f)
-    screenshot_index = 1
+def write_screenshot_files(worker: Worker, party: Party):
+    """Replaces the screenshot files of the party on disk by the ones of the last check."""
+    # the index must follow, the identifier of another party may start with this one (e.g. anna and anna_schmidt)
+    remove_files(f'{OUT_PATH}/screenshot_{party.identifier}_[0-9]*.jpg')
+    return worker.screenshots.write(OUT_PATH)
 
 
 def get_config(config_file):
@@ -480,77 +841,220 @@ def get_config(config_file):
         return data
 
 
-browser: WebDriver
+def load_parties(config_file) -> Tuple[str, List[Party]]:
+    config = get_config(config_file)
+    return config['admin_email'], [Party(**party) for party in config['parties']]
 
 
-def setup_browser():
-    global browser
+def validate_config(config) -> List[str]:
+    """Returns the problems of the configuration (see config-example.yml), an empty list if it is valid."""
+    if not isinstance(config, dict) or not isinstance(config.get('parties'), list):
+        return ['"parties" must be a list']
 
-    chrome_options = set_chrome_options()
-    browser = webdriver.Chrome(options=chrome_options)
+    problems = []
+    if not config.get('admin_email'):
+        problems.append('"admin_email" is missing')
 
+    identifiers = {}
+    for index, data in enumerate(config['parties']):
+        name = data.get('name') if isinstance(data, dict) and data.get('name') else f'#{index + 1}'
+        try:
+            party = Party(**data)
+        except TypeError as e:
+            problems.append(f'party {name}: {e}')
+            continue
+
+        if party.identifier in identifiers:
+            problems.append(f'party {name}: same identifier ({party.identifier}) as {identifiers[party.identifier]}')
+        identifiers[party.identifier] = name
+        if not party.recipient or '@' not in party.recipient:
+            problems.append(f'party {name}: "recipient" must be an e-mail address')
+        if not re.match(r'https?://[^/]+/(.*/)?$', party.url or ''):
+            problems.append(f'party {name}: "url" must be like https://005-iz.impfterminservice.de/ (ending with /)')
+        if not re.fullmatch(r'\d{5}', str(party.postal_code or '')):
+            problems.append(f'party {name}: "postal_code" must have 5 digits')
+        if party.code and not re.fullmatch(r'[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}', party.code):
+            problems.append(f'party {name}: "code" must be like XXXX-XXXX-XXXX')
+        if not party.code and not isinstance(party.age, int):
+            problems.append(f'party {name}: "age" is needed if there is no "code"')
+        if party.vaccine_code and not re.fullmatch(r'[A-Z0-9]+(,[A-Z0-9]+)*', party.vaccine_code):
+            problems.append(f'party {name}: "vaccine_code" must be like L920 or L920,L921')
+        if party.centers is not None and (not isinstance(party.centers, list) or not all(
+                re.match(r'https?://[^/]+/(.*/)?$', str(url)) for url in party.centers)):
+            problems.append(f'party {name}: "centers" must be a list of urls like "url"')
+        if party.radius is not None and (not isinstance(party.radius, int) or party.radius <= 0):
+            problems.append(f'party {name}: "radius" must be a number of km')
+        if party.auto_book:
+            if not party.code:
+                problems.append(f'party {name}: "auto_book" needs a "code"')
+            missing = get_missing_fields(party.address)
+            if missing:
+                problems.append(f'party {name}: "auto_book" needs the complete address, missing: {", ".join(missing)}')
+    return problems
+
+
+def print_plan(parties: List[Party]):
+    groups = plan_groups(parties)
+    print(f'{len(parties)} party(s) in {len(groups)} check group(s):')
+    for group in groups:
+        party = group.parties[0]
+        key = f'code {party.code}' if party.code else f'age {get_age_bracket(party.age)}+'
+        centers = ' + '.join(get_host(url) for url in party.urls)
+        radius = f' {party.radius} km' if party.radius else ''
+        print(f'  {centers} {party.postal_code}{radius} {party.vaccine_code or "-"} ({key}): '
+              f'{", ".join(member.name for member in group.parties)}')
+
+
+def restore_saved_states(parties: List[Party]) -> int:
+    """Restores the state of the parties saved in the state store, returns the number of restored parties."""
+    if not state_store:
+        return 0
+    saved_states = state_store.load()
+    restored = [party for party in parties if party.identifier in saved_states]
+    for party in restored:
+        party.restore_state(saved_states[party.identifier])
+    return len(restored)
+
+
+def watch_config(config_file, on_change, interval_sec=CONFIG_POLL_SEC):
+    """Calls on_change() (in a background thread) if the config file has been modified or on SIGHUP."""
+    requested = threading.Event()
+    # must be called from the main thread
+    signal.signal(signal.SIGHUP, lambda *_: requested.set())
+
+    def get_mtime():
+        try:
+            return os.stat(config_file).st_mtime_ns
+        except OSError:
+            return None
 
-def main():
-    parser = argparse.ArgumentParser(description='Corona Impf-o-mat')
-    parser.add_argument('--config', help="Path to the configuration file. See documentation for details.",
-                        default="config.yml")
-    parser.add_argument('--retry', help="Retry time in seconds, 0 to disable", type=int, default=0)
-    parser.add_argument('--test-mail', help="Just send a mail for testing")
+    def run():
+        mtime = get_mtime()
+        while True:
+            requested.wait(interval_sec)
+            current = get_mtime()
+            if requested.is_set() or (current is not None and current != mtime):
+                requested.clear()
+                mtime = current
+                on_change()
 
-    args = parser.parse_args()
+    threading.Thread(target=run, name='config-watch', daemon=True).start()
 
-    if args.test_mail:
-        recipient = args.test_mail
-        send_mail(recipient,
-                  'Test Mail',
-                  f"""This is just a test.
-                                    
-If you can read this text, everything is just fine!
-""",
-                  None,
-                  None)
-        sys.exit()
 
-    config_file = os.path.join(os.path.dirname(__file__), '..', args.config)
-    config = get_config(config_file)
+def reload_config(config_file, plan: 'CheckPlan', scheduler: Scheduler):
+    """Applies the modified configuration to the plan, the added groups are scheduled right away."""
+    try:
+        admin_email, parties = load_parties(config_file)
+    except Exception as e:
+        print(f'Could not reload {config_file}, keeping the current configuration: {e}')
+        return
 
-    admin_email = config['admin_email']
-    parties: List[Party] = [Party(**party) for party in config['parties']]
+    restore_saved_states(parties)
+    added, removed = plan.update(admin_email, parties)
+    for group in added:
+        scheduler.add(group, get_host(group.url), group.get_next_check_delay(0))
+    print(f'Reloaded {config_file}: {len(plan.parties)} party(s) in {len(plan.groups)} check group(s), '
+          f'{len(added)} added, {len(removed)} removed')
 
-    remove_screenshot_files()
 
-    global browser
-    start_display()
-    setup_browser()
+def setup_browser() -> 'WebDriver':
+    from selenium import webdriver
 
-    print(f"Using Chrome Browser v{browser.capabilities['browserVersion']}")
+    chrome_options = set_chrome_options(browser_config)
+    browser = webdriver.Chrome(options=chrome_options)
+    if profiler:
+        browser = profiler.instrument(browser)
 
-    while True:
-        for party in parties:
+    # there are no content settings (prefs) for fonts and scripts, so these are blocked by URL
+    blocked_urls = [pattern for resource in browser_config.block for pattern in BLOCKED_URL_PATTERNS.get(resource, [])]
+    if blocked_urls:
+        browser.execute_cdp_cmd('Network.enable', {})
+        browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
 
-            web_url = get_url(code=party.code,
-                              postal_code=party.postal_code,
-                              url=party.url)
+    if session_store:
+        session_store.restore(browser)
+    return browser
 
-            # if the last check was successful, skip processing for 20 minutes
-            if party.status == ScheduleStatus.pending and party.last_check_duration().seconds < 20 * 60:
-                continue
 
-            # if the party has already a valid schedule, skip the processing for 2 hours
-            if party.status == ScheduleStatus.scheduled and party.last_check_duration().seconds < 2 * 60 * 60:
-                continue
+def plan_groups(parties: List[Party]) -> List[PartyGroup]:
+    """Groups the parties sharing the same check, so every group is checked only once."""
+    groups = {}
+    for party in parties:
+        groups.setdefault(party.group_key, []).append(party)
+    return [PartyGroup(members) for members in groups.values()]
+
+
+class CheckPlan:
+    """
+    The configured parties and their check groups. A reload of the configuration updates the plan in place: the
+    state of the remaining parties is kept and the changed groups are replaced (the old ones become inactive).
+    """
+
+    def __init__(self, admin_email: str, parties: List[Party]):
+        self.admin_email = admin_email
+        self.parties = {}
+        self.groups = {}
+        self.update(admin_email, parties)
+
+    def update(self, admin_email: str, parties: List[Party]) -> Tuple[List[PartyGroup], List[PartyGroup]]:
+        """Returns the added and the removed groups."""
+        self.admin_email = admin_email
 
-            # if the party is in the error state for longer than 120 minutes, send an
-            # admin notification.
-            if (party.status == ScheduleStatus.error
-                    and party.last_check_timestamp is not None
-                    and party.last_check_duration().seconds > 120 * 60
-                    and not party.error_notification_sent):
-                if admin_email:
-                    files = glob.glob(f'{OUT_PATH}/*.*')
-                    send_mail(admin_email,
-                              f'Corona Impf-o-mat :: Error ({party.name})',
-                              f"""There were persistent errors.                              
+        merged = {}
+        for party in parties:
+            current = self.parties.get(party.identifier)
+            if current and current.get_config() == party.get_config():
+                party = current
+            elif current:
+                party.restore_state(current.get_state())
+            merged[party.identifier] = party
+        self.parties = merged
+
+        groups = {}
+        added = []
+        removed = []
+        for group in plan_groups(list(merged.values())):
+            key = group.parties[0].group_key
+            current = self.groups.get(key)
+            if current and len(current.parties) == len(group.parties) \
+                    and all(a is b for a, b in zip(current.parties, group.parties)):
+                groups[key] = current
+                continue
+            groups[key] = group
+            added.append(group)
+            if current:
+                removed.append(current)
+        removed += [group for key, group in self.groups.items() if key not in groups]
+
+        for group in removed:
+            group.active = False
+        self.groups = groups
+        return added, removed
+
+
+# the files in out/ written per party, other files (e.g. the state database) must not be matched
+PARTY_FILE_PATTERNS = ('screenshot_{id}_[0-9]*.jpg', 'cookies_{id}.json', 'console_{id}.jsonl', 'page_{id}.html',
+                       'form_{id}.html', 'ersttermin_{id}.json', 'error-*-{id}-*')
+
+
+def get_party_files(party: Party) -> List[str]:
+    return [file for pattern in PARTY_FILE_PATTERNS
+            for file in glob.glob(os.path.join(OUT_PATH, pattern.format(id=party.identifier)))]
+
+
+def notify_persistent_error(party: Party, admin_email: str):
+    # if the party is in the error state for longer than 120 minutes, send an
+    # admin notification.
+    if (party.status == ScheduleStatus.error
+            and party.last_check_timestamp is not None
+            and party.last_check_duration().total_seconds() > 120 * 60
+            and not party.error_notification_sent):
+        if admin_email:
+            web_url = get_url(code=party.code, postal_code=party.postal_code, url=party.url)
+            files = get_party_files(party)
+            send_mail(admin_email,
+                      f'Corona Impf-o-mat :: Error ({party.name})',
+                      f"""There were persistent errors.                              
 
 Party: {party.name}
 Code: {party.code}
@@ -567,79 +1071,186 @@ To book an appointment, use this URL:
 <{web_url}>
 
 """,
-                              None,
-                              files)
-
-                    party.error_notification_sent = True
-                    for file in files:
-                        os.remove(file)
-
-            remove_screenshot_files()
-            try:
-                success = process(party)
-                old_status = party.status
-
-                if old_status == ScheduleStatus.error and party.error_notification_sent:
-                    if admin_email:
-                        party.error_notification_sent = False
-                        send_mail(admin_email,
-                                  f'Corona Impf-o-mat :: Recovery ({party.name})',
-                                  f"""This is a recovery notification
-                                  
+                      None,
+                      files)
+
+            party.error_notification_sent = True
+            for file in files:
+                os.remove(file)
+
+
+def apply_check_result(party: Party, success: bool, admin_email: str, attachments: list, center: str = None):
+    """center is the url of the center having the appointments, if it is not the one of the party."""
+    web_url = get_url(code=party.code, postal_code=party.postal_code, url=center or party.url)
+    old_status = party.status
+
+    if old_status == ScheduleStatus.error and party.error_notification_sent:
+        if admin_email:
+            party.error_notification_sent = False
+            send_mail(admin_email,
+                      f'Corona Impf-o-mat :: Recovery ({party.name})',
+                      f"""This is a recovery notification
+                      
 Party: {party.name}
 Last successful check timestamp: {party.last_check_timestamp}
 
 """)
 
-                party.update_check_result(success)
+    party.update_check_result(success)
 
-                if success:
-                    send_mail(
-                        party.recipient,
-                        f'Corona Impf-o-mat :: Notification',
-                        f"""Corona vaccines are currently available, see the attached screenshots.
+    if success:
+        send_mail(
+            party.recipient,
+            f'Corona Impf-o-mat :: Notification',
+            f"""Corona vaccines are currently available, see the attached screenshots.
 
 Profile Name: {party.name}
 Reservation Code: {party.code}
+Center: {get_host(center or party.url)}
 
 To book an appointment, use this URL:
 
 <{web_url}>
 
 """,
-                        None,
-                        glob.glob(f'{OUT_PATH}/screenshot_*.*'))
-
-            except ErrorAlreadyScheduled as e:
-                print(e)
-                party.update_status(ScheduleStatus.scheduled)
-
-            except Error as error:
-                party.update_status(ScheduleStatus.error, error=error)
-                print(error)
-                last_error = get_last_browser_error()
-                if last_error:
-                    print(last_error)
-                    if "429" in last_error:
-                        print(f'Got 429 error: reset browser and wait 2 minutes')
-                        browser.close()
-                        time.sleep(2 * 60)
-                        setup_browser()
-
-            except Exception as e:
-                ts_string = get_timestamp().strftime('%Y%m%d%H%M%S')
-                write_file(f'error-{ts_string}-console.log', json.dumps(browser.get_log('browser')))
-                print(f"Got an error while trying to parse the page, "
-                      f"will save the screenshot and page source to error-{ts_string}-*")
-                screenshot(browser, f'error-{ts_string}-screenshot')
-                write_file(f'error-{ts_string}-pagesource.html', browser.page_source)
-
-                files = glob.glob(f'{OUT_PATH}/error-{ts_string}*')
-                if admin_email:
-                    send_mail(admin_email,
-                              f'Corona Impf-o-mat :: Error ({party.name})',
-                              f"""There were errors while interacting with the URL <{web_url}> :
-Party: {party.name}
+            None,
+            attachments)
+
+
+def auto_book(worker: Worker, party: Party) -> str:
+    """Books the first appointment found by the check, returns the confirmation or None if the booking failed."""
+    from selenium.common.exceptions import WebDriverException
+    worker.trace.note('auto booking...')
+    try:
+        confirmation = book(worker, party.address)
+    except (BookingError, WebDriverException) as e:
+        worker.trace.note(f'=> booking failed: {e}')
+        screenshot(worker, party)
+        return None
+    worker.trace.note(f'=> booked: {confirmation}')
+    screenshot(worker, party)
+    return confirmation
+
+
+def send_booking_mail(party: Party, confirmation: str, attachments: list):
+    send_mail(
+        party.recipient,
+        f'Corona Impf-o-mat :: Booked',
+        f"""An appointment has been booked automatically, see the attached screenshots.
+
+Profile Name: {party.name}
+Reservation Code: {party.code}
+
+{confirmation}
+
+""",
+        None,
+        attachments)
+
+
+def write_profile_report(final=False):
+    """Writes out/profile.txt (and out/profile.pstats with the cProfile stats at the end of the run)."""
+    report = profiler.report(python=final)
+    artifacts.write('profile.txt', report)
+    if final:
+        profiler.dump_python(f'{OUT_PATH}/profile.pstats')
+        print(report)
+
+
+def check_group(worker: Worker, group: PartyGroup, admin_email: str) -> bool:
+    """
+    Checks a group of parties once (using the first due member) and applies the result to all due members.
+    Returns True if the host has throttled the requests (429).
+    """
+    members = [member for member in group.parties if get_next_check_delay(member, 0) <= 0]
+    if not members:
+        return False
+
+    party = members[0]
+    browser = worker.browser
+
+    web_url = get_url(code=party.code,
+                      postal_code=party.postal_code,
+                      url=party.url)
+
+    for member in members:
+        notify_persistent_error(member, admin_email)
+
+    worker.begin_check(party)
+    throttled = False
+    outcome = 'exception'
+    start = time.monotonic()
+    try:
+        success = process_api(worker, party) if worker.api and party.api_checkable else process(worker, party)
+        outcome = 'appointments' if success else 'no_appointments'
+        if len(members) > 1:
+            worker.trace.note(f'(result shared with {", ".join(member.name for member in members[1:])})')
+
+        # the booking continues in the same session (the api engine verifies the slots in the browser as well), the
+        # slots found may be gone with the next check
+        confirmation = None
+        if success and party.auto_book:
+            confirmation = auto_book(worker, party)
+
+        if success:
+            write_screenshot_files(worker, party)
+
+        if confirmation:
+            outcome = 'booked'
+            send_booking_mail(party, confirmation, worker.screenshots.attachments())
+            for member in members:
+                member.update_status(ScheduleStatus.scheduled)
+                member.last_check_timestamp = get_timestamp()
+        else:
+            for member in members:
+                apply_check_result(member, success, admin_email, worker.screenshots.attachments(), worker.center)
+
+        # keep the session (e.g. the waiting room pass) for new browser sessions
+        if session_store:
+            session_store.save(worker.browser)
+
+    except ErrorAlreadyScheduled as e:
+        outcome = 'scheduled'
+        worker.trace.note(str(e))
+        for member in members:
+            member.update_status(ScheduleStatus.scheduled)
+            # the 2 hours skip window is based on this timestamp
+            member.last_check_timestamp = get_timestamp()
+
+    except Error as error:
+        for member in members:
+            member.update_status(ScheduleStatus.error, error=error)
+        worker.trace.note(f'=> {error}')
+        # the persistent error notification attaches the screenshots on disk (see get_party_files())
+        if worker.screenshots.attachments():
+            write_screenshot_files(worker, party)
+        throttled = isinstance(error, ErrorThrottled)
+        last_error = get_last_browser_error(browser)
+        if last_error:
+            worker.trace.note(f'(browser: {last_error})')
+        if worker.network.poll(browser).throttled():
+            # the host will cool down in the scheduler, meanwhile other hosts can be checked
+            worker.trace.note('(got 429 error: reset browser)')
+            throttled = True
+            worker.restart_browser('429')
+        outcome = 'throttled' if throttled else 'error'
+
+    except Exception as e:
+        ts_string = get_timestamp().strftime('%Y%m%d%H%M%S')
+        prefix = f'error-{ts_string}-{party.identifier}'
+        write_file(f'{prefix}-console.log', json.dumps(browser.get_log('browser')))
+        worker.trace.note(f"=> got an error while trying to parse the page ({type(e).__name__}), "
+                          f"will save the screenshot and page source to {prefix}-*")
+        screenshot(worker, party, 'screenshot')
+        worker.screenshots.write(OUT_PATH, f'{prefix}-')
+        write_file(f'{prefix}-pagesource.html', browser.page_source)
+
+        files = glob.glob(f'{OUT_PATH}/{prefix}*')
+        if admin_email:
+            send_mail(admin_email,
+                      f'Corona Impf-o-mat :: Error ({party.name})',
+                      f"""There were errors while interacting with the URL <{web_url}> :
+Party: {', '.join(member.name for member in members)}
 Code: {party.code}
 Postal Code: {party.postal_code}
 
@@ -649,23 +1260,383 @@ Error
 {e}
 
 """,
-                              None,
-                              files)
+                      None,
+                      files)
+
+            for file in files:
+                os.remove(file)
+
+    finally:
+        # the browser only returns the console entries since the last call, so they are appended
+        artifacts.append(f'console_{party.identifier}.jsonl', worker.browser.get_log('browser'))
+        write_file(f'cookies_{party.identifier}.json', json.dumps(worker.browser.get_cookies(), sort_keys=True))
+        worker.outcome = outcome
+        log_check(worker, party, members, outcome, time.monotonic() - start)
+        if history_store:
+            history_store.record(get_host(worker.center or party.url), party.identifier, outcome, worker.ersttermin)
+        record_metrics(party, worker.timer, time.monotonic() - start, throttled)
+        if state_store:
+            for member in members:
+                state_store.save(member.identifier, member.get_state())
+
+        if profiler:
+            profiler.stop_python()
+            if profiler.report_due():
+                write_profile_report()
+
+        if worker.browser_used:
+            worker.checks += 1
+        if worker.browser_used and worker.needs_recycle():
+            print(f'recycle the browser session of worker #{worker.id} after {worker.checks} check(s)')
+            if session_store:
+                session_store.save(worker.browser)
+            worker.restart_browser('recycle')
+
+    return throttled
+
+
+def get_next_check_delay(party: Party, retry: int) -> float:
+    """Seconds until the party is due for the next check."""
+    if party.status == ScheduleStatus.pending:
+        # if the last check was successful, skip processing for 20 minutes
+        window = 20 * 60
+    elif party.status == ScheduleStatus.scheduled:
+        # if the party has already a valid schedule, skip the processing for 2 hours
+        window = 2 * 60 * 60
+    else:
+        return retry
+
+    if party.last_check_timestamp is None:
+        return retry
+    return max(window - party.last_check_duration().total_seconds(), retry)
+
+
+def get_retry(group: PartyGroup, retry: int) -> float:
+    """The retry interval of the group, stretched outside of the usual release windows of its center."""
+    if not history_store:
+        return retry
+    return history_store.get_retry(get_host(group.url), retry)
+
+
+def create_scheduler(plan: CheckPlan, retry: int, rate_per_min: float, burst=1, config_file=None) -> Scheduler:
+    """
+    Schedules the groups of the plan, the plan is updated if the config file is modified (if given). With retry 0
+    (check every party just once) the groups in a skip window are not checked at all instead of waiting for it.
+    """
+    scheduler = Scheduler(rate_per_min, burst=burst)
+    skipped = 0
+    for group in plan.groups.values():
+        delay = group.get_next_check_delay(0)
+        if delay > 0 and not retry:
+            skipped += 1
+            continue
+        scheduler.add(group, get_host(group.url), delay)
+
+    print(f'{len(plan.parties)} party(s) in {len(plan.groups)} check group(s)'
+          + (f', {skipped} skipped (not due)' if skipped else ''))
+    if config_file:
+        watch_config(config_file, lambda: reload_config(config_file, plan, scheduler))
+    return scheduler
+
+    if config_file:
+        watch_config(config_file, lambda: reload_config(config_file, plan, scheduler))
+    return scheduler
+
+
+def run_checks(workers: List[Worker], plan: CheckPlan, retry: int, rate_per_min: float, config_file=None):
+    """
+    Checks the parties by their due time, spreading them over the available workers. Parties sharing the same check
+    are grouped and checked once, a group is only checked by one worker at a time.
+    With retry == 0 every party is checked just once, else the config file is reloaded if modified.
+    """
+    scheduler = create_scheduler(plan, retry, rate_per_min, len(workers), config_file if retry else None)
+
+    idle_workers = queue.Queue()
+    for worker in workers:
+        idle_workers.put(worker)
+
+    def run(_worker: Worker, _group: PartyGroup):
+        throttled = False
+        try:
+            # the group may have been removed by a reload of the configuration meanwhile
+            if _group.active:
+                throttled = check_group(_worker, _group, plan.admin_email)
+        finally:
+            delay = _group.get_next_check_delay(get_retry(_group, retry)) if retry and _group.active else None
+            scheduler.done(_group, get_host(_group.url), delay, throttled)
+            idle_workers.put(_worker)
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        while True:
+            worker = idle_workers.get()
+
+            # propagate errors of the finished checks
+            for future in [f for f in futures if f.done()]:
+                futures.remove(future)
+                future.result()
+
+            group = scheduler.get()
+            if group is None:
+                break
+            futures.append(executor.submit(run, worker, group))
+
+    for future in futures:
+        future.result()
+
+
+def run_coordinator(plan: CheckPlan, retry: int, rate_per_min: float, address, token, config_file=None):
+    """Schedules the checks like run_checks(), but leases them to the cluster workers (see run_worker())."""
+    scheduler = create_scheduler(plan, retry, rate_per_min, config_file=config_file if retry else None)
+
+    def encode(group: PartyGroup):
+        return {
+            'admin_email': plan.admin_email,
+            'parties': [{'config': member.get_config(), 'state': member.get_state()} for member in group.parties],
+        }
+
+    def complete(group: PartyGroup, result: dict):
+        for member, state in zip(group.parties, result['states']):
+            member.restore_state(state)
+            if state_store:
+                state_store.save(member.identifier, member.get_state())
+        if history_store and result.get('outcome'):
+            history_store.record(get_host(result.get('center') or group.url), group.parties[0].identifier,
+                                 result['outcome'], result.get('ersttermin'))
+        return group.get_next_check_delay(get_retry(group, retry)) if retry and group.active else None
+
+    coordinator = Coordinator(scheduler, encode, complete, lambda group: get_host(group.url), token)
+    coordinator.serve(address)
+
+
+def run_worker(worker: Worker, client: CoordinatorClient):
+    """Checks the groups leased by the coordinator until it has nothing left to be checked."""
+    while True:
+        try:
+            lease = client.claim()
+        except (OSError, ValueError, ClusterError) as e:
+            print(f'worker #{worker.id}: coordinator not available ({e}), retry in {RECONNECT_SEC}s')
+            time.sleep(RECONNECT_SEC)
+            continue
+
+        if lease['id'] is None:
+            if lease['finished']:
+                return
+            continue
+
+        parties = []
+        for member in lease['item']['parties']:
+            party = Party(**member['config'])
+            party.restore_state(member['state'])
+            parties.append(party)
+        group = PartyGroup(parties)
+
+        throttled = False
+        worker.outcome = None
+        worker.center = None
+        try:
+            throttled = check_group(worker, group, lease['item']['admin_email'])
+        finally:
+            try:
+                client.complete(lease['id'], {'states': [party.get_state() for party in group.parties],
+                                              'throttled': throttled,
+                                              'outcome': worker.outcome,
+                                              'center': worker.center,
+                                              'ersttermin': worker.ersttermin})
+            except (OSError, ValueError, ClusterError) as e:
+                # the lease will expire and the group will be checked again
+                print(f'worker #{worker.id}: could not report the result ({e})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corona Impf-o-mat')
+    parser.add_argument('--config', help="Path to the configuration file. See documentation for details.",
+                        default="config.yml")
+    parser.add_argument('--retry', help="Minimum time in seconds between two checks of the same party, "
+                                        "0 to check every party just once", type=int, default=0)
+    parser.add_argument('--host-rate', help="Maximum number of checks per minute and host "
+                                            "(default depends on the engine and the number of workers)", type=float)
+    parser.add_argument('--workers', help="Number of parallel browser sessions", type=int, default=1)
+    parser.add_argument('--headless', help="Use Chrome's headless mode instead of a virtual X display (Xvfb)",
+                        action='store_true')
+    parser.add_argument('--window-size', help="Browser window size", default='923x1011')
+    parser.add_argument('--block', help="Comma separated resources not to be loaded: images, fonts, scripts "
+                                        "(third-party)", default='images')
+    parser.add_argument('--engine', help="Check engine: 'browser' renders the whole page, 'api' polls the REST API "
+                                         "and uses the browser only if appointments are available",
+                        choices=['browser', 'api'], default='browser')
+    parser.add_argument('--test-mail', help="Just send a mail for testing")
+    parser.add_argument('--validate', help="Just validate the configuration file and show the check groups",
+                        action='store_true')
+    parser.add_argument('--state', help="SQLite file to persist the party state across restarts, empty to disable",
+                        default=f'{OUT_PATH}/state.sqlite')
+    parser.add_argument('--sessions', help="JSON file to persist the browser sessions (cookies, localStorage) "
+                                           "per host, empty to disable", default=f'{OUT_PATH}/sessions.json')
+    parser.add_argument('--recycle-after', help="Recycle the browser session after N checks, 0 to disable",
+                        type=int, default=50)
+    parser.add_argument('--recycle-memory', help="Recycle the browser session if the JS heap exceeds N MB, "
+                                                 "0 to disable", type=int, default=300)
+    parser.add_argument('--metrics-port', help="Port of the HTTP metrics endpoint (Prometheus format), "
+                                               "0 to disable", type=int, default=0)
+    parser.add_argument('--mail-transport', help="'ses' sends the mails, 'stub' just writes them to out/mail",
+                        choices=['ses', 'stub'], default='ses')
+    parser.add_argument('--retention-days', help="Days to keep the error dumps and rotated console logs in out/, "
+                                                 "0 to keep them forever", type=float, default=7)
+    parser.add_argument('--history', help="SQLite file of all check results, used to check more often when the "
+                                          "centers usually release appointments, empty to disable",
+                        default=f'{OUT_PATH}/history.sqlite')
+    parser.add_argument('--idle-factor', help="Outside of the usual release windows, the parties are checked every "
+                                              "retry * N seconds (1 to disable)", type=float, default=4)
+    parser.add_argument('--cache', help="JSON file to keep the cached site data (e.g. the vaccination lists) "
+                                        "between runs, empty to keep it in memory only",
+                        default=f'{OUT_PATH}/cache.json')
+    parser.add_argument('--events', help="JSON lines file of the check steps and results (see events.py for "
+                                         "reports), empty to disable", default=f'{OUT_PATH}/events.jsonl')
+    parser.add_argument('--profile', help="Profile the WebDriver commands per party and check step, the report is "
+                                          "written to out/profile.txt", action='store_true')
+    parser.add_argument('--cprofile', help="With --profile, also profile the Python code of the checks (cProfile), "
+                                           "see out/profile.pstats", action='store_true')
+    roles = parser.add_mutually_exclusive_group()
+    roles.add_argument('--listen', help="Run as cluster coordinator on [HOST:]PORT (localhost by default, use e.g. "
+                                         "0.0.0.0:7000 for remote workers), the checks are done by the workers "
+                                         "(see --coordinator)")
+    roles.add_argument('--coordinator', help="Run as cluster worker of the coordinator at HOST:PORT, the parties "
+                                             "are leased by the coordinator (no config file needed)")
+    parser.add_argument('--cluster-token', help="Shared secret of the coordinator and its workers",
+                        default=os.environ.get('CLUSTER_TOKEN'))
+
+    args = parser.parse_args()
+    # the leases contain the codes and addresses of the parties
+    if args.listen and not args.cluster_token and not is_loopback(parse_address(args.listen)[0]):
+        parser.error('--listen on a public address needs a --cluster-token (or CLUSTER_TOKEN)')
+
+    startup = StepTimer()
+    startup.record('imports', time.monotonic() - START_TIME)
 
-                    for file in files:
-                        os.remove(file)
+    if args.validate:
+        config_file = os.path.join(os.path.dirname(__file__), '..', args.config)
+        try:
+            config = get_config(config_file)
+        except (OSError, yaml.YAMLError) as e:
+            print(f'Unable to read {config_file}: {e}')
+            sys.exit(1)
+        problems = validate_config(config)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print_plan([Party(**party) for party in config['parties']])
+        print(f'{args.config} is valid ({(time.monotonic() - START_TIME) * 1000:.0f} ms)')
+        sys.exit()
+
+    global notifier
+    transport = SesTransport() if args.mail_transport == 'ses' else StubTransport(f'{OUT_PATH}/mail')
+    notifier = Dispatcher(transport)
+    notifier.start()
 
-            finally:
-                write_file(f'console_{party.identifier}.json', json.dumps(browser.get_log('browser')))
-                write_file(f'cookies_{party.identifier}.json', json.dumps(browser.get_cookies()))
+    artifacts.retention_sec = args.retention_days * 24 * 60 * 60
 
-                # wait a short while before processing the next party
-                time.sleep(10)
+    global response_cache
+    response_cache = ResponseCache(args.cache or None)
 
-        if args.retry == 0:
-            break
+    global profiler
+    if args.profile and not args.listen:
+        profiler = CommandProfiler(python=args.cprofile)
+
+    global event_log
+    if args.events and not args.listen:
+        event_log = EventLog(args.events)
+        event_log.start()
+
+    if args.test_mail:
+        recipient = args.test_mail
+        send_mail(recipient,
+                  'Test Mail',
+                  f"""This is just a test.
+                                    
+If you can read this text, everything is just fine!
+""",
+                  None,
+                  None)
+        notifier.close()
+        sys.exit()
 
-        time.sleep(args.retry)
+    if not args.coordinator:
+        with startup.step('config'):
+            config_file = os.path.join(os.path.dirname(__file__), '..', args.config)
+            admin_email, parties = load_parties(config_file)
+
+            # the workers of a cluster are stateless, the state is kept by the coordinator
+            global state_store
+            if args.state:
+                state_store = StateStore(args.state)
+                print(f'Restored the state of {restore_saved_states(parties)} party(s)')
+            plan = CheckPlan(admin_email, parties)
+            if any(party.centers and (args.engine != 'api' or not party.api_checkable) for party in parties):
+                print('the further "centers" of the parties are only checked by the api engine (--engine api), '
+                      'for parties with a code and a vaccine_code')
+
+            global history_store
+            if args.history:
+                history_store = HistoryStore(args.history, args.idle_factor)
+
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
+        print(f'Serving metrics on port {args.metrics_port}')
+
+    if args.listen:
+        # the coordinator does not need a browser, the rate limit applies to the checks of all workers
+        rate_per_min = args.host_rate or max(args.workers, 1) * 60 / (API_PARTY_DELAY_SEC if args.engine == 'api'
+                                                                      else PARTY_DELAY_SEC)
+        print(f'Startup: {startup.summary()} (total={startup.total():.1f}s)')
+        run_coordinator(plan, args.retry, rate_per_min, parse_address(args.listen), args.cluster_token,
+                        config_file)
+    else:
+        global session_store
+        if args.sessions:
+            session_store = SessionStore(args.sessions)
+
+        global browser_config
+        width, height = args.window_size.split('x')
+        browser_config = BrowserConfig(headless=args.headless, window_size=(int(width), int(height)),
+                                       block=tuple(filter(None, args.block.split(','))))
+        if not browser_config.headless:
+            with startup.step('display'):
+                start_display()
+
+        with startup.step('browsers'):
+            # the browsers are started in parallel
+            count = max(args.workers, 1)
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                browsers = list(executor.map(lambda _: setup_browser(), range(count)))
+            workers = [Worker(id=i, browser=browser,
+                              api=ApiClient(cache=response_cache) if args.engine == 'api' else None,
+                              recycle_after=args.recycle_after, recycle_memory_mb=args.recycle_memory)
+                       for i, browser in enumerate(browsers)]
+
+        print(f"Using Chrome Browser v{workers[0].browser.capabilities['browserVersion']} ({len(workers)} worker(s))")
+        print(f'Startup: {startup.summary()} (total={startup.total():.1f}s)')
+
+        if args.coordinator:
+            client = CoordinatorClient(parse_address(args.coordinator), args.cluster_token)
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                for future in [executor.submit(run_worker, worker, client) for worker in workers]:
+                    future.result()
+        else:
+            rate_per_min = args.host_rate or len(workers) * 60 / (API_PARTY_DELAY_SEC if args.engine == 'api'
+                                                                    else PARTY_DELAY_SEC)
+            run_checks(workers, plan, args.retry, rate_per_min, config_file)
+
+        if profiler:
+            write_profile_report(final=True)
+
+    if state_store:
+        state_store.close()
+    if history_store:
+        history_store.close()
+    if event_log:
+        event_log.close()
+    notifier.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+"""
+Minimal Prometheus style metrics (counters and histograms) with an optional HTTP endpoint, no extra dependencies.
+"""
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+_metrics = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            entry = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", bound)])} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", "+Inf")])} {entry[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {entry[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {entry[-1]}')
+        return lines
+
+
+def render():
+    return '\n'.join(line for metric in _metrics for line in metric.render()) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port, address=''):
+    server = ThreadingHTTPServer((address, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+STEP_DURATION = Histogram('impfomat_step_duration_seconds',
+                          'Duration of the named check steps (incl. waiting_room and challenge_validation)',
+                          ['host', 'step'])
+CHECK_DURATION = Histogram('impfomat_check_duration_seconds', 'Duration of a whole check', ['host'])
+CHECKS = Counter('impfomat_checks_total', 'Checks by resulting party status', ['host', 'status'])
+THROTTLED = Counter('impfomat_throttled_total', 'Checks throttled by the host (429)', ['host'])
+MAIL_DURATION = Histogram('impfomat_mail_send_duration_seconds', 'Latency of sending a mail')
+MAIL_FAILURES = Counter('impfomat_mail_failures_total', 'Failed mail delivery attempts')
+BROWSER_RESTARTS = Counter('impfomat_browser_restarts_total', 'Browser sessions restarted', ['reason'])
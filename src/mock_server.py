@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an impfterminservice.de center, for offline tuning and benchmarking.
+
+The first path segment selects the scenario flags, e.g. a party with the url http://localhost:8000/waiting_room,cookies/
+will see the waiting room and the cookie banner before the (default) "no appointments" result. Flags:
+
+    appointments    appointments are available (else "no appointments")
+    maintenance     the "Wartungsarbeiten" page
+    waiting_room    the "Virtueller Warteraum" page, passed after WAITING_ROOM_SEC
+    challenge       the "Challenge Validation" page (code flow), passed after CHALLENGE_SEC
+    scheduled       the "Ihr Termin am" page (code flow)
+    cookies         the "Cookie Hinweis" banner
+
+With appointments, the search result continues with the booking dialog (slot pair, personal data form, "Verbindlich
+buchen"), the booking is posted to rest/buchung and answered with the "Ihr Termin am" confirmation.
+
+The pages can be replaced by recorded ones using --pages DIR (files named like the templates below, e.g.
+search_form.html, the placeholders {base} and {cookie_banner} are substituted).
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+WAITING_ROOM_SEC = 3
+CHALLENGE_SEC = 2
+
+COOKIE_BANNER = """
+<div class="cookies-info"><b>Cookie Hinweis</b> Diese Website verwendet Cookies.
+<button class="cookies-info-close" onclick="document.cookie='cookies_accepted=1; path=/'; this.parentNode.remove()">
+Auswahl bestätigen</button></div>
+"""
+
+TEMPLATES = {
+    'maintenance': """<html><head><title>Impfterminservice</title></head><body>
+<h1>Wartungsarbeiten</h1><p>Die Seite ist aufgrund von Wartungsarbeiten derzeit nicht erreichbar.</p>
+</body></html>""",
+
+    'waiting_room': """<html><head><title>Impfterminservice - Warteraum</title></head><body>
+<h1>Virtueller Warteraum</h1><p>Sie befinden sich im virtuellen Warteraum.</p>
+<script>setTimeout(function() {
+  document.cookie = 'waiting_room_passed=1; path=/'; location.reload();
+}, {waiting_room_ms});</script>
+</body></html>""",
+
+    'challenge': """<html><head><title>Challenge Validation</title></head><body><p>Bitte warten...</p>
+<script>setTimeout(function() {
+  document.cookie = 'challenge_passed=1; path=/'; location.reload();
+}, {challenge_ms});</script>
+</body></html>""",
+
+    'scheduled': """<html><head><title>Impfterminservice</title></head><body>{cookie_banner}
+<h2 class="ets-booking-headline">Ihr Termin am 01.06.2021 um 10:00 Uhr</h2>
+</body></html>""",
+
+    'search_form': """<html><head><title>Impfterminservice</title></head><body>{cookie_banner}
+<p>Bitte wählen Sie ein Terminpaar für Ihre Corona-Schutzimpfung.</p>
+<button class="search-filter-button" onclick="search()">Termine suchen</button>
+<div id="result"></div>
+<script>
+function search() {
+  const result = document.getElementById('result');
+  result.textContent = 'Termine werden gesucht...';
+  fetch('{base}rest/suche/ersttermin?plz=00000').then(r => r.json()).then(data => {
+    result.innerHTML = data.termine.length
+      ? '<div class="its-slot-pair-search-info"><label><input type="radio" name="slot-pair" '
+        + 'onchange="document.getElementById(\\'select\\').disabled = false"> '
+        + data.termine[0][0].begin + '</label></div>'
+        + '<button id="select" disabled onclick="selectSlots()">Auswählen</button>'
+      : 'Derzeit stehen leider keine Termine zur Verfügung.';
+  }, () => result.textContent = 'Fehler');
+}
+function selectSlots() {
+  document.getElementById('result').innerHTML = '<button onclick="showForm()">Daten erfassen</button>';
+}
+function showForm() {
+  const fields = ['firstname', 'lastname', 'plz', 'city', 'street', 'housenumber', 'phone', 'notificationReceiver'];
+  document.getElementById('result').innerHTML = '<form onsubmit="return false">'
+    + ['Frau', 'Herr', 'Divers'].map(s => '<label><input type="radio" name="salutation" value="' + s + '"> '
+        + s + '</label>').join('')
+    + fields.map(f => '<input formcontrolname="' + f + '">').join('')
+    + '<button type="button" onclick="applyForm()">Übernehmen</button></form>';
+}
+function applyForm() {
+  const form = document.querySelector('form');
+  const data = {salutation: (form.querySelector('input[name=salutation]:checked') || {}).value};
+  form.querySelectorAll('input[formcontrolname]').forEach(input => data[input.getAttribute('formcontrolname')] =
+    input.value);
+  form.style.display = 'none';
+  const button = document.createElement('button');
+  button.textContent = 'Verbindlich buchen';
+  button.onclick = () => fetch('{base}rest/buchung', {method: 'POST', body: JSON.stringify(data)})
+    .then(r => r.ok ? r.json() : Promise.reject(r.status))
+    .then(booking => document.getElementById('result').innerHTML =
+      '<h2 class="ets-booking-headline">Ihr Termin am ' + booking.termin + '</h2>',
+      status => document.getElementById('result').textContent = 'Fehler ' + status);
+  document.getElementById('result').appendChild(button);
+}
+</script>
+</body></html>""",
+
+    'claim_form': """<html><head><title>Impfterminservice</title></head><body>{cookie_banner}
+<app-corona-vaccination>
+<div><h1>Onlinebuchung für Ihre Corona-Schutzimpfung</h1></div>
+<div><div><p>Wurde Ihr Anspruch auf eine Corona-Schutzimpfung bereits geprüft?</p>
+<div><label><span>Ja</span></label><label><span onclick="claim()">Nein</span></label></div>
+</div></div>
+<div id="step2"></div>
+</app-corona-vaccination>
+<script>
+function claim() {
+  document.getElementById('step2').innerHTML =
+    '<div><div><div><div class="ets-login-form-section in"><div><app-corona-vaccination-no><form>'
+    + '<div>Folgende Personen haben Anspruch auf eine Schutzimpfung.</div>'
+    + '<div class="form-group d-flex justify-content-center"><div>'
+    + '<p>Gehören Sie einer dieser Personengruppen an?</p>'
+    + '<div><label><span>Ja</span></label><label><span>Nein</span></label></div></div></div>'
+    + '<div><input name="age" type="number"></div>'
+    + '<div><button type="button" onclick="check()">Prüfen</button></div>'
+    + '</form></app-corona-vaccination-no></div></div></div></div></div>';
+}
+function check() {
+  fetch('{base}rest/suche/ersttermin?plz=00000').then(r => r.json()).then(data => {
+    const result = document.createElement('div');
+    result.textContent = data.termine.length
+      ? 'Es sind Termine verfügbar.'
+      : 'Es wurden keine freien Termine in Ihrer Region gefunden.';
+    document.body.appendChild(result);
+  });
+}
+</script>
+</body></html>""",
+}
+
+VACCINATION_LIST = [
+    {'qualifikation': 'L920', 'name': 'BioNTech', 'tssname': 'BioNTech', 'interval': 40, 'age': '16+'},
+    {'qualifikation': 'L921', 'name': 'Moderna', 'tssname': 'Moderna', 'interval': 40, 'age': '18+'},
+]
+
+BOOKING_FIELDS = ('salutation', 'firstname', 'lastname', 'plz', 'city', 'street', 'housenumber', 'phone',
+                  'notificationReceiver')
+
+SLOTS = [[{'begin': '2021-06-01T10:00:00', 'bsnr': '005221080', 'duration': 5, 'slotId': 'slot-1'},
+          {'begin': '2021-07-13T10:00:00', 'bsnr': '005221080', 'duration': 5, 'slotId': 'slot-2'}]]
+
+
+def render(template, **values):
+    # only the placeholders are replaced, recorded pages are full of CSS and JS braces
+    for name, value in values.items():
+        template = template.replace(f'{{{name}}}', str(value))
+    return template
+
+
+class MockConfig:
+    def __init__(self, latency=0.0, error_rate=0.0, pages_path=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.pages_path = pages_path
+
+    def template(self, name):
+        if self.pages_path and os.path.exists(f'{self.pages_path}/{name}.html'):
+            with open(f'{self.pages_path}/{name}.html') as file:
+                return file.read()
+        return TEMPLATES[name]
+
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body, content_type='text/html; charset=utf-8'):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if config.latency:
+                time.sleep(config.latency)
+
+            url = urlparse(self.path)
+            segments = url.path.strip('/').split('/')
+            flags = set(segments[0].split(',')) if segments and segments[0] else set()
+            path = '/'.join(segments[1:])
+            base = f'/{segments[0]}/' if segments and segments[0] else '/'
+            cookies = self.headers.get('Cookie', '')
+
+            if path.startswith('rest/') or path.startswith('assets/'):
+                return self.rest(path, flags)
+
+            if 'maintenance' in flags:
+                return self.page('maintenance', base, cookies)
+            if 'waiting_room' in flags and 'waiting_room_passed' not in cookies:
+                return self.page('waiting_room', base, cookies)
+
+            if path.startswith('impftermine/suche/'):
+                if 'challenge' in flags and 'challenge_passed' not in cookies:
+                    return self.page('challenge', base, cookies)
+                if 'scheduled' in flags:
+                    return self.page('scheduled', base, cookies, 'cookies' in flags)
+                return self.page('search_form', base, cookies, 'cookies' in flags)
+
+            if path.startswith('impftermine/service'):
+                return self.page('claim_form', base, cookies, 'cookies' in flags)
+
+            return self.send(404, 'not found', 'text/plain')
+
+        def do_POST(self):
+            if config.latency:
+                time.sleep(config.latency)
+
+            segments = urlparse(self.path).path.strip('/').split('/')
+            flags = set(segments[0].split(',')) if segments and segments[0] else set()
+            if '/'.join(segments[1:]) != 'rest/buchung' or 'appointments' not in flags:
+                return self.send(404, 'not found', 'text/plain')
+
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                return self.send(400, 'invalid JSON', 'text/plain')
+            missing = [name for name in BOOKING_FIELDS if not data.get(name)]
+            if missing:
+                return self.send(400, f'missing: {", ".join(missing)}', 'text/plain')
+            return self.send(201, json.dumps({'termin': '01.06.2021 um 10:00 Uhr'}), 'application/json')
+
+        def page(self, name, base, cookies, cookie_banner=False):
+            show_banner = cookie_banner and 'cookies_accepted' not in cookies
+            self.send(200, render(config.template(name),
+                                  base=base,
+                                  cookie_banner=COOKIE_BANNER if show_banner else '',
+                                  waiting_room_ms=WAITING_ROOM_SEC * 1000,
+                                  challenge_ms=CHALLENGE_SEC * 1000))
+
+        def rest(self, path, flags):
+            if config.error_rate and random.random() < config.error_rate:
+                return self.send(429, 'Too Many Requests', 'text/plain')
+
+            if path.startswith('rest/suche/ersttermin'):
+                body = {'termine': SLOTS if 'appointments' in flags else [], 'termineTSS': [], 'praxen': {}}
+                return self.send(200, json.dumps(body), 'application/json')
+            if path == 'rest/version':
+                return self.send(200, '1.0.0-mock', 'text/plain')
+            if path == 'assets/static/its/vaccination-list.json':
+                return self.send(200, json.dumps(VACCINATION_LIST), 'application/json')
+            return self.send(404, 'not found', 'text/plain')
+
+    return Handler
+
+
+def start_server(config: MockConfig, port=0, address='127.0.0.1') -> ThreadingHTTPServer:
+    """Starts the mock server in a background thread, use port 0 to pick a free one (see server_address)."""
+    server = ThreadingHTTPServer((address, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corona Impf-o-mat :: local mock of impfterminservice.de')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--latency', help="Added latency per request in seconds", type=float, default=0.0)
+    parser.add_argument('--error-rate', help="Share of the REST requests answered with 429", type=float, default=0.0)
+    parser.add_argument('--pages', help="Directory with recorded pages replacing the built-in templates")
+    args = parser.parse_args()
+
+    server = start_server(MockConfig(args.latency, args.error_rate, args.pages), args.port, args.address)
+    print(f'Serving the mock impfterminservice on http://{args.address}:{server.server_address[1]}/')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
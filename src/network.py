@@ -0,0 +1,66 @@
+"""
+Network responses of a browser session, read from the Chrome DevTools performance log. This gives the real
+HTTP status codes (e.g. 429) and the /rest/suche/* responses without searching the page or the console log.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+# requires the performance log, see enable_performance_log()
+LOG_TYPE = 'performance'
+
+
+def enable_performance_log(chrome_options):
+    chrome_options.set_capability('goog:loggingPrefs', {LOG_TYPE: 'ALL'})
+    chrome_options.experimental_options['perfLoggingPrefs'] = {'enableNetwork': True, 'enablePage': False}
+
+
+@dataclass
+class Response:
+    request_id: str
+    url: str
+    status: int
+    resource_type: str
+
+
+class NetworkMonitor:
+    """Collects the responses since the last clear(), each poll() only fetches the new log entries."""
+
+    def __init__(self):
+        self.responses: List[Response] = []
+
+    def poll(self, browser: WebDriver):
+        for entry in browser.get_log(LOG_TYPE):
+            message = json.loads(entry['message'])['message']
+            if message['method'] != 'Network.responseReceived':
+                continue
+            params = message['params']
+            self.responses.append(Response(request_id=params['requestId'],
+                                           url=params['response']['url'],
+                                           status=params['response']['status'],
+                                           resource_type=params.get('type')))
+        return self
+
+    def clear(self, browser: WebDriver):
+        """Drops the collected responses and the pending log entries, e.g. at the start of a check."""
+        browser.get_log(LOG_TYPE)
+        self.responses = []
+
+    def throttled(self) -> bool:
+        return any(response.status == 429 for response in self.responses)
+
+    def last(self, url_fragment) -> Response:
+        for response in reversed(self.responses):
+            if url_fragment in response.url:
+                return response
+        return None
+
+    @staticmethod
+    def get_body(browser: WebDriver, response: Response) -> str:
+        return browser.execute_cdp_cmd('Network.getResponseBody', {'requestId': response.request_id})['body']
@@ -0,0 +1,230 @@
+"""
+Mail notifications, delivered in the background so a slow SES call does not delay the checks.
+"""
+
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import List, Tuple
+
+from metrics import MAIL_DURATION, MAIL_FAILURES
+
+# SES and mail configuration
+SENDER = os.environ.get('SENDER')
+AWS_REGION = os.environ.get('SES_AWS_REGION')
+CHARSET = "UTF-8"
+
+FOOTER = """
+
+-- 
+Corona Impf-o-mat
+"""
+
+# notifications to the same recipient queued within this window are merged into a single mail
+MERGE_WINDOW_SEC = 5
+MAX_ATTEMPTS = 5
+BACKOFF_SEC = 5
+
+
+@dataclass
+class Notification:
+    recipient: str
+    title: str
+    text: str = None
+    html: str = None
+    # (filename, content) tuples, read when queuing as the files may be gone when the mail is actually sent
+    attachments: List[Tuple[str, bytes]] = field(default_factory=list)
+
+
+def read_attachments(files: list) -> List[Tuple[str, bytes]]:
+    """Reads the files to attach, (filename, content) tuples (e.g. in-memory screenshots) are passed through."""
+    attachments = []
+    for file in files or []:
+        if isinstance(file, tuple):
+            attachments.append(file)
+            continue
+        with open(file, 'rb') as f:
+            attachments.append((os.path.basename(file), f.read()))
+    return attachments
+
+
+def create_multipart_message(
+        sender: str, recipients: list, title: str, text: str = None, html: str = None, attachments: list = None) \
+        -> MIMEMultipart:
+    """
+    Creates a MIME multipart message object.
+    Uses only the Python `email` standard library.
+    Emails, both sender and recipients, can be just the email string or have the format 'The Name <the_email@host.com>'.
+
+    :param sender: The sender.
+    :param recipients: List of recipients. Needs to be a list, even if only one recipient.
+    :param title: The title of the email.
+    :param text: The text version of the email body (optional).
+    :param html: The html version of the email body (optional).
+    :param attachments: List of (filename, content) tuples to attach in the email.
+    :return: A `MIMEMultipart` to be used to send the email.
+    """
+    multipart_content_subtype = 'alternative' if text and html else 'mixed'
+    msg = MIMEMultipart(multipart_content_subtype)
+    msg['Subject'] = title
+    msg['From'] = sender
+    msg['To'] = ', '.join(recipients)
+
+    # Record the MIME types of both parts - text/plain and text/html.
+    # According to RFC 2046, the last part of a multipart message, in this case the HTML message, is best and preferred.
+    if text:
+        part = MIMEText(text, 'plain')
+        msg.attach(part)
+    if html:
+        part = MIMEText(html, 'html')
+        msg.attach(part)
+
+    # Add attachments
+    for filename, content in attachments or []:
+        part = MIMEApplication(content)
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        msg.attach(part)
+
+    return msg
+
+
+def merge(notifications: List[Notification]) -> Notification:
+    if len(notifications) == 1:
+        return notifications[0]
+
+    first = notifications[0]
+    separator = '\n\n' + '=' * 40 + '\n\n'
+    return Notification(
+        recipient=first.recipient,
+        title=f'{first.title} (+{len(notifications) - 1} more)',
+        text=separator.join(n.text for n in notifications if n.text) or None,
+        html='<hr>'.join(n.html for n in notifications if n.html) or None,
+        attachments=[attachment for n in notifications for attachment in n.attachments])
+
+
+class SesTransport:
+    """Sends the mails using AWS SES, the sender needs to be a verified email in SES."""
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # boto3 takes a while to import, so it is only loaded when the first mail is sent
+            import boto3
+            self._client = boto3.session.Session().client('ses')  # Use your settings here
+        return self._client
+
+    def send(self, recipient: str, raw_message: str):
+        return self.client.send_raw_email(
+            Source=SENDER,
+            Destinations=[recipient],
+            RawMessage={'Data': raw_message}
+        )
+
+
+class StubTransport:
+    """Writes the mails to a local directory instead of sending them, for offline testing."""
+
+    def __init__(self, path):
+        self.path = path
+        self.sent = []
+
+    def send(self, recipient: str, raw_message: str):
+        os.makedirs(self.path, exist_ok=True)
+        filename = f'{self.path}/mail-{time.time_ns()}.eml'
+        with open(filename, 'w') as file:
+            file.write(raw_message)
+        self.sent.append((recipient, filename))
+
+
+def send_mail(transport, notification: Notification):
+    text = (notification.text or '') + FOOTER
+    msg = create_multipart_message(SENDER, [notification.recipient], notification.title, text, notification.html,
+                                   notification.attachments)
+    print(f'will send an email to {notification.recipient} from {SENDER}')
+    start = time.monotonic()
+    response = transport.send(notification.recipient, msg.as_string())
+    MAIL_DURATION.observe(time.monotonic() - start)
+    return response
+
+
+class Dispatcher:
+    """
+    Background queue delivering the notifications: alerts to the same recipient within a short window are merged,
+    failed deliveries are retried with exponential backoff.
+    """
+
+    def __init__(self, transport, merge_window_sec=MERGE_WINDOW_SEC, max_attempts=MAX_ATTEMPTS,
+                 backoff_sec=BACKOFF_SEC):
+        self.transport = transport
+        self.merge_window_sec = merge_window_sec
+        self.max_attempts = max_attempts
+        self.backoff_sec = backoff_sec
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='notifications', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self, notification: Notification):
+        self.queue.put(notification)
+
+    def close(self, timeout=None):
+        """Delivers all queued notifications (without waiting for the merge window) and stops the thread."""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        # recipient -> (due time, notifications), waiting for the merge window to pass
+        batches = {}
+        # (due time, attempt, merged notification), waiting for the next delivery attempt
+        retries = []
+        closing = False
+
+        while True:
+            if closing:
+                timeout = 0
+            else:
+                due_times = [due for due, _ in batches.values()] + [due for due, _, _ in retries]
+                timeout = max(0.0, min(due_times) - time.monotonic()) if due_times else None
+
+            try:
+                item = self.queue.get(timeout=timeout) if timeout != 0 else self.queue.get_nowait()
+                if item is None:
+                    closing = True
+                else:
+                    due, notifications = batches.get(item.recipient, (time.monotonic() + self.merge_window_sec, []))
+                    batches[item.recipient] = (due, notifications + [item])
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for recipient, (due, notifications) in list(batches.items()):
+                if closing or due <= now:
+                    del batches[recipient]
+                    retries.append((now, 0, merge(notifications)))
+
+            for entry in [entry for entry in retries if closing or entry[0] <= now]:
+                retries.remove(entry)
+                _, attempt, notification = entry
+                try:
+                    send_mail(self.transport, notification)
+                except Exception as e:
+                    MAIL_FAILURES.inc()
+                    attempt += 1
+                    if closing or attempt >= self.max_attempts:
+                        print(f'unable to send the mail to {notification.recipient} after {attempt} attempt(s): {e}')
+                    else:
+                        delay = self.backoff_sec * 2 ** (attempt - 1)
+                        print(f'unable to send the mail to {notification.recipient}, retry in {delay}s: {e}')
+                        retries.append((time.monotonic() + delay, attempt, notification))
+
+            if closing and not batches and not retries:
+                return
@@ -0,0 +1,98 @@
+"""
+Snapshot of the current page, the source is fetched once per page state and scanned once for all known markers.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+MARKERS = (
+    "Wartungsarbeiten",
+    "Cookie Hinweis",
+    "Virtueller Warteraum",
+    "Ihr Termin am",
+    "Termine suchen",
+    "Termine werden gesucht",
+    "leider keine Termine",
+    "Es wurden keine freien Termine",
+    "Es wurden keine freien",
+    "Wurde Ihr Anspruch",
+    "Folgende Personen",
+    "Gehören Sie",
+)
+
+# longest markers first, so a marker being a prefix of another one does not shadow the longer one
+_MARKERS_RE = re.compile('|'.join(re.escape(marker) for marker in sorted(MARKERS, key=len, reverse=True)))
+
+# one round trip instead of separate page_source, title and current_url commands
+_SNAPSHOT_JS = "return [document.documentElement.outerHTML, document.title, window.location.href];"
+
+
+class PageState(Enum):
+    maintenance = 'maintenance'
+    waiting_room = 'waiting room'
+    challenge_validation = 'challenge validation'
+    already_scheduled = 'already scheduled'
+    no_appointments = 'no appointments'
+    searching = 'searching'
+    search_form = 'search form'
+    age_form = 'age form'
+    claim_form = 'claim form'
+    unknown = 'unknown'
+
+
+def find_markers(source: str) -> frozenset:
+    found = set(_MARKERS_RE.findall(source))
+    # also report the markers being part of a longer marker which was found
+    return frozenset(marker for marker in MARKERS if any(marker in f for f in found))
+
+
+@dataclass(frozen=True)
+class PageSnapshot:
+    source: str
+    title: str
+    url: str
+    markers: frozenset
+
+    @classmethod
+    def capture(cls, browser: WebDriver):
+        source, title, url = browser.execute_script(_SNAPSHOT_JS)
+        return cls(source=source, title=title, url=url, markers=find_markers(source))
+
+    def __contains__(self, text):
+        if text in MARKERS:
+            return text in self.markers
+        return text in self.source
+
+    @property
+    def cookie_banner(self):
+        return "Cookie Hinweis" in self.markers
+
+    @property
+    def state(self) -> PageState:
+        markers = self.markers
+        if "Wartungsarbeiten" in markers:
+            return PageState.maintenance
+        if "Virtueller Warteraum" in markers:
+            return PageState.waiting_room
+        if "Challenge Validation" in self.title:
+            return PageState.challenge_validation
+        if "Ihr Termin am" in markers:
+            return PageState.already_scheduled
+        if "leider keine Termine" in markers or "Es wurden keine freien" in markers:
+            return PageState.no_appointments
+        if "Termine werden gesucht" in markers:
+            return PageState.searching
+        if "Termine suchen" in markers:
+            return PageState.search_form
+        if "Gehören Sie" in markers:
+            return PageState.age_form
+        if "Wurde Ihr Anspruch" in markers:
+            return PageState.claim_form
+        return PageState.unknown
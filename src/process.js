@@ -1,8 +1,12 @@
+// Installed on the first action in a document (see run_process_action() in main.py), the further actions are then
+// called through window.impfomat.run(action) without sending this script again.
+
 // noinspection JSUnresolvedVariable
-(function(arguments, window) {
+(function(window) {
 
-  const done = arguments[arguments.length - 1];
-  const action = arguments[0];
+  if (window.impfomat) {
+    return;
+  }
 
   // basically just a simple wrapper around XMLHttpRequest
   async function get_url(url) {
@@ -62,9 +66,14 @@
     return await get_url(url);
   }
 
-  process(action).then(
-      result => done(result),
-      error => done(error)
-  );
+  // runs the actions in parallel, the result maps each action to its response (or error)
+  async function batch(actions) {
+    const results = await Promise.all(actions.map(action => process(action).catch(error => error)));
+    return Object.fromEntries(actions.map((action, i) => [action, results[i]]));
+  }
+
+  window.impfomat = {
+    run: (action, args) => action === 'batch' ? batch(args) : process(action)
+  };
 
-})(arguments, window);
+})(window);
@@ -0,0 +1,197 @@
+"""
+WebDriver command profiler (see --profile of main.py): the browser is wrapped in a ProfiledWebDriver, which
+records each command sent to the driver (count, time and JSON payload bytes of the request and the response)
+per party and per branch of the check (the step running at the time, see StepTimer). The Python code of the
+checks can be profiled with cProfile as well. The report is printed at the end of the run.
+"""
+
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+TOP_CALLS = 20
+# the report is updated at most every REPORT_INTERVAL_SEC while running, see report_due()
+REPORT_INTERVAL_SEC = 60
+
+
+@dataclass
+class CommandStats:
+    count: int = 0
+    duration: float = 0.0
+    bytes: int = 0
+
+    def add(self, duration, size):
+        self.count += 1
+        self.duration += duration
+        self.bytes += size
+
+
+def get_payload_size(payload) -> int:
+    # only measured in the profile mode, so the extra serialization does not matter
+    return len(json.dumps(payload, default=str)) if payload is not None else 0
+
+
+def get_command_name(command, params) -> str:
+    # the CDP commands are sent through the same driver command, e.g. executeCdpCommand:Network.getResponseBody
+    if isinstance(params, dict) and 'cmd' in params:
+        return f'{command}:{params["cmd"]}'
+    return command
+
+
+class ProfiledWebDriver:
+    """Proxy of the WebDriver which attributes the commands of the browser to the current party and branch."""
+
+    def __init__(self, browser, profiler: 'CommandProfiler'):
+        self.wrapped_browser = browser
+        self.profiler = profiler
+        self.party = '-'
+        self.timer = None
+
+        # all commands, including the ones of the WebElements (element.click(), ...), go through the executor
+        executor = browser.command_executor
+        execute = executor.execute
+
+        def profiled_execute(command, params=None):
+            start = time.monotonic()
+            response = execute(command, params)
+            duration = time.monotonic() - start
+            value = response.get('value') if isinstance(response, dict) else response
+            profiler.record(self.party, self.branch, get_command_name(command, params), duration,
+                            get_payload_size(params) + get_payload_size(value))
+            return response
+
+        executor.execute = profiled_execute
+
+    def bind(self, party, timer):
+        """Attributes the following commands to the party, the branch is the step of the timer running then."""
+        self.party = party
+        self.timer = timer
+
+    @property
+    def branch(self):
+        if self.timer is None or not self.timer.active:
+            return '-'
+        return self.timer.active[-1]
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped_browser, name)
+
+
+class CommandProfiler:
+    def __init__(self, python=False):
+        self.python = python
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_report = self.started
+        # (party, branch, command) -> CommandStats
+        self.stats = defaultdict(CommandStats)
+        # one cProfile profile per thread, cProfile only profiles the thread it is enabled in
+        self.python_profiles = []
+        self.local = threading.local()
+
+    def instrument(self, browser) -> ProfiledWebDriver:
+        return ProfiledWebDriver(browser, self)
+
+    def record(self, party, branch, command, duration, size):
+        with self.lock:
+            self.stats[(party, branch, command)].add(duration, size)
+
+    def start_python(self):
+        """Starts the cProfile profile of the current thread (if enabled), see stop_python()."""
+        if not self.python:
+            return
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            import cProfile
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.python_profiles.append(profile)
+        profile.enable()
+
+    def stop_python(self):
+        profile = getattr(self.local, 'profile', None)
+        if profile is not None:
+            profile.disable()
+
+    def get_python_stats(self):
+        """The merged pstats.Stats of all threads, None if there are none (yet)."""
+        with self.lock:
+            profiles = list(self.python_profiles)
+        if not profiles:
+            return None
+        import pstats
+        return pstats.Stats(*profiles, stream=io.StringIO())
+
+    def totals(self, key_index):
+        """The stats summed up by party (0), branch (1) or command (2)."""
+        totals = defaultdict(CommandStats)
+        with self.lock:
+            for key, stats in self.stats.items():
+                total = totals[key[key_index]]
+                total.count += stats.count
+                total.duration += stats.duration
+                total.bytes += stats.bytes
+        return totals
+
+    def report_due(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_report < REPORT_INTERVAL_SEC:
+                return False
+            self.last_report = now
+            return True
+
+    def report(self, top=TOP_CALLS, python=True) -> str:
+        """
+        The report of the WebDriver commands (and of the Python code if profiled). The cProfile stats should only
+        be included once the checks are done, as merging them stops the profiles.
+        """
+        lines = []
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1].duration, reverse=True)
+        count = sum(item.count for _, item in stats)
+        duration = sum(item.duration for _, item in stats)
+        lines.append(f'WebDriver commands: {count} in {duration:.1f}s '
+                     f'({time.monotonic() - self.started:.0f}s run time)')
+
+        lines.append('')
+        lines.append(f'{"command":<64} {"count":>7} {"total s":>9} {"avg ms":>8} {"KB":>9}')
+        for command, total in sorted(self.totals(2).items(), key=lambda item: item[1].duration, reverse=True):
+            lines.append(format_row(command, total))
+
+        for title, key_index in (('party', 0), ('branch', 1)):
+            lines.append('')
+            lines.append(f'{title:<64} {"count":>7} {"total s":>9} {"avg ms":>8} {"KB":>9}')
+            for name, total in sorted(self.totals(key_index).items(), key=lambda item: item[1].duration,
+                                      reverse=True):
+                lines.append(format_row(name, total))
+
+        lines.append('')
+        lines.append('Most expensive calls (party / branch / command):')
+        for (party, branch, command), item in stats[:top]:
+            lines.append(format_row(f'{party} / {branch} / {command}', item))
+
+        python_stats = self.get_python_stats() if python else None
+        if python_stats:
+            lines.append('')
+            lines.append('Python (cProfile, by cumulative time):')
+            python_stats.stream = io.StringIO()
+            python_stats.sort_stats('cumulative').print_stats(top)
+            lines.append(python_stats.stream.getvalue().strip('\n'))
+        return '\n'.join(lines) + '\n'
+
+    def dump_python(self, path) -> bool:
+        """Writes the merged cProfile stats (e.g. for snakeviz), returns False if there are none."""
+        python_stats = self.get_python_stats()
+        if python_stats is None:
+            return False
+        python_stats.dump_stats(path)
+        return True
+
+
+def format_row(name, stats: CommandStats) -> str:
+    average = stats.duration / stats.count * 1000 if stats.count else 0
+    return f'{name:<64} {stats.count:>7} {stats.duration:>9.2f} {average:>8.1f} {stats.bytes / 1024:>9.1f}'
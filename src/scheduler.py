@@ -0,0 +1,144 @@
+"""
+Priority scheduler handing out the checks by their due time, limited per host by a token bucket.
+A host returning 429 errors cools down with an exponential backoff, the other hosts keep going meanwhile.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+BACKOFF_SEC = 120
+MAX_BACKOFF_SEC = 30 * 60
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, burst, now):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + max(now - self.updated, 0) * self.rate_per_sec)
+        self.updated = max(now, self.updated)
+
+    def wait_time(self, now):
+        """Seconds until a token is available."""
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate_per_sec
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+
+class Host:
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class Scheduler:
+    """
+    Thread safe scheduler: get() blocks until an item is due and its host is allowed to be checked, done() reports
+    the result and reschedules the item. Items are not handed out again while being checked.
+    """
+
+    def __init__(self, rate_per_min, burst=1, backoff_sec=BACKOFF_SEC, max_backoff_sec=MAX_BACKOFF_SEC,
+                 clock=time.monotonic):
+        self.rate_per_sec = rate_per_min / 60
+        self.burst = burst
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.hosts = {}
+        self.in_flight = 0
+
+    def _host(self, name) -> Host:
+        if name not in self.hosts:
+            self.hosts[name] = Host(TokenBucket(self.rate_per_sec, self.burst, self.clock()))
+        return self.hosts[name]
+
+    def _push(self, due, host, item):
+        heapq.heappush(self.heap, (due, next(self.counter), host, item))
+
+    def add(self, item, host, delay=0.0):
+        with self.condition:
+            self._push(self.clock() + delay, host, item)
+            self.condition.notify_all()
+
+    def _pop_ready(self):
+        """Returns the next item to be checked or None and the seconds to wait for the next one."""
+        while self.heap:
+            now = self.clock()
+            due, _, host_name, item = self.heap[0]
+            if due > now:
+                return None, due - now
+
+            host = self._host(host_name)
+            if host.cooldown_until > now:
+                heapq.heapreplace(self.heap, (host.cooldown_until, next(self.counter), host_name, item))
+                continue
+
+            wait = host.bucket.wait_time(now)
+            if wait > 0:
+                heapq.heapreplace(self.heap, (now + wait, next(self.counter), host_name, item))
+                continue
+
+            host.bucket.take(now)
+            heapq.heappop(self.heap)
+            return item, 0
+        return None, None
+
+    def get(self, timeout=None):
+        """
+        Blocks until the next item is ready, returns None if there is nothing left to be checked (or after `timeout`
+        seconds, see finished).
+        """
+        with self.condition:
+            deadline = None if timeout is None else self.clock() + timeout
+            while True:
+                item, wait = self._pop_ready()
+                if item is not None:
+                    self.in_flight += 1
+                    return item
+                if wait is None and self.in_flight == 0:
+                    return None
+                if deadline is not None:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.condition.wait(wait)
+
+    @property
+    def finished(self) -> bool:
+        with self.condition:
+            return not self.heap and self.in_flight == 0
+
+    def done(self, item, host, delay=None, throttled=False):
+        """
+        Reports a finished check. The item is checked again after `delay` seconds (None to drop it), a throttled
+        host will cool down with an exponential backoff (with jitter) before being checked again.
+        """
+        with self.condition:
+            now = self.clock()
+            state = self._host(host)
+            if throttled:
+                state.failures += 1
+                backoff = min(self.max_backoff_sec, self.backoff_sec * 2 ** (state.failures - 1))
+                state.cooldown_until = now + backoff * random.uniform(0.5, 1.5)
+                print(f'{host} is throttled, cool down for {state.cooldown_until - now:.0f}s')
+            else:
+                state.failures = 0
+
+            self.in_flight -= 1
+            if delay is not None:
+                self._push(now + delay, host, item)
+            self.condition.notify_all()
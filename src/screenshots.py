@@ -0,0 +1,68 @@
+"""
+Screenshots are kept in a bounded in-memory ring and only written to disk (or attached to a mail) on success or error.
+They are downscaled and re-encoded as JPEG by the browser itself (CDP), so no image library is needed.
+"""
+
+from __future__ import annotations
+
+import base64
+import glob
+import os
+from collections import deque
+from typing import TYPE_CHECKING, List, Tuple
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+MAX_SCREENSHOTS = 10
+SCALE = 0.5
+JPEG_QUALITY = 60
+
+
+def capture(browser: WebDriver, scale=SCALE, quality=JPEG_QUALITY) -> bytes:
+    viewport = browser.execute_cdp_cmd('Page.getLayoutMetrics', {})['layoutViewport']
+    result = browser.execute_cdp_cmd('Page.captureScreenshot', {
+        'format': 'jpeg',
+        'quality': quality,
+        'clip': {
+            'x': viewport['pageX'],
+            'y': viewport['pageY'],
+            'width': viewport['clientWidth'],
+            'height': viewport['clientHeight'],
+            'scale': scale,
+        },
+    })
+    return base64.b64decode(result['data'])
+
+
+class ScreenshotRing:
+    """The last MAX_SCREENSHOTS screenshots of the current check."""
+
+    def __init__(self, size=MAX_SCREENSHOTS):
+        self.items = deque(maxlen=size)
+        self.index = 1
+
+    def capture(self, browser: WebDriver, name):
+        self.items.append((f'{name}.jpg', capture(browser)))
+        self.index += 1
+
+    def clear(self):
+        self.items.clear()
+        self.index = 1
+
+    def attachments(self) -> List[Tuple[str, bytes]]:
+        return list(self.items)
+
+    def write(self, path, prefix='') -> List[str]:
+        files = []
+        for filename, content in self.items:
+            file = f'{path}/{prefix}{filename}'
+            with open(file, 'wb') as f:
+                f.write(content)
+            files.append(file)
+        return files
+
+
+def remove_files(pattern):
+    for file in glob.glob(pattern):
+        os.remove(file)
@@ -0,0 +1,87 @@
+"""
+Browser session persistence: the cookies and the localStorage of each host are saved and restored into new
+browser sessions, so a new (or recycled) browser does not have to pass the waiting room again.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+_GET_LOCAL_STORAGE_JS = "return Object.assign({}, window.localStorage);"
+
+# evaluated on every new document before the page scripts, restores the saved items of the matching host
+_RESTORE_LOCAL_STORAGE_JS = """
+(function(sessions) {
+  const items = sessions[window.location.host];
+  if (!items) return;
+  for (const [key, value] of Object.entries(items)) {
+    if (window.localStorage.getItem(key) === null) window.localStorage.setItem(key, value);
+  }
+})(%s);
+"""
+
+# see https://chromedevtools.github.io/devtools-protocol/tot/Network/#type-CookieParam
+_COOKIE_PARAMS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+
+
+def to_cookie_param(cookie: dict) -> dict:
+    param = {key: cookie[key] for key in _COOKIE_PARAMS if key in cookie}
+    if 'expiry' in cookie:
+        param['expires'] = cookie['expiry']
+    return param
+
+
+def get_js_heap_size(browser: WebDriver) -> int:
+    """Returns the used JS heap of the current page in bytes (0 if not available)."""
+    return browser.execute_script("return window.performance.memory ? performance.memory.usedJSHeapSize : 0;") or 0
+
+
+class SessionStore:
+    """Cookies and localStorage per host, kept in memory and persisted to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sessions = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.sessions = json.load(file)
+
+    def save(self, browser: WebDriver):
+        """Saves the session of the host currently loaded in the browser."""
+        host = urlparse(browser.current_url).netloc
+        if not host:
+            return
+
+        session = {
+            'cookies': browser.get_cookies(),
+            'local_storage': browser.execute_script(_GET_LOCAL_STORAGE_JS) or {},
+        }
+        with self.lock:
+            if self.sessions.get(host) == session:
+                return
+            self.sessions[host] = session
+            with open(f'{self.path}.tmp', 'w') as file:
+                json.dump(self.sessions, file)
+            os.replace(f'{self.path}.tmp', self.path)
+
+    def restore(self, browser: WebDriver):
+        """Restores all saved sessions into a new browser, without having to navigate to the hosts first."""
+        with self.lock:
+            sessions = dict(self.sessions)
+        if not sessions:
+            return
+
+        cookies = [to_cookie_param(cookie) for session in sessions.values() for cookie in session['cookies']]
+        browser.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+
+        local_storage = {host: session['local_storage'] for host, session in sessions.items()}
+        browser.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument',
+                                {'source': _RESTORE_LOCAL_STORAGE_JS % json.dumps(local_storage)})
@@ -0,0 +1,54 @@
+"""
+Durable party state, so the skip and backoff windows survive a restart of the container.
+"""
+
+import sqlite3
+import threading
+import time
+
+FLUSH_INTERVAL_SEC = 30
+
+COLUMNS = ('status', 'last_check_timestamp', 'last_check_success', 'error_notification_sent', 'last_error')
+
+
+class StateStore:
+    """SQLite backed store of the per-party state (plain dicts keyed by the party identifier), writes are batched."""
+
+    def __init__(self, path, flush_interval_sec=FLUSH_INTERVAL_SEC):
+        self.flush_interval_sec = flush_interval_sec
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS party_state ('
+                                f'identifier TEXT PRIMARY KEY, {", ".join(COLUMNS)})')
+        self.connection.commit()
+
+    def load(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute(f'SELECT identifier, {", ".join(COLUMNS)} FROM party_state').fetchall()
+        return {row[0]: dict(zip(COLUMNS, row[1:])) for row in rows}
+
+    def save(self, identifier, state: dict):
+        """Queues the state to be written, the actual write is done at most every flush_interval_sec seconds."""
+        with self.lock:
+            self.pending[identifier] = state
+            if time.monotonic() - self.last_flush < self.flush_interval_sec:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.connection.executemany(
+                    f'INSERT OR REPLACE INTO party_state (identifier, {", ".join(COLUMNS)}) '
+                    f'VALUES (?, {", ".join("?" for _ in COLUMNS)})',
+                    [(identifier, *(state.get(column) for column in COLUMNS))
+                     for identifier, state in self.pending.items()])
+                self.connection.commit()
+                self.pending = {}
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
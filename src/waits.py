@@ -0,0 +1,148 @@
+"""
+Event driven waits based on DOM conditions and a simple timer recording the duration of the named check steps.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from selenium.webdriver.chrome.webdriver import WebDriver
+
+POLL_FREQUENCY = 0.25
+
+# per-step timeouts in seconds
+TIMEOUTS = {
+    'load': 30,
+    'cookie_banner': 10,
+    'waiting_room': 900,
+    'challenge_validation': 60,
+    'search': 30,
+    'age_form': 20,
+    'booking': 30,
+}
+
+# evaluated in the browser, so only a boolean has to be transferred instead of the whole page source
+_PAGE_CONTAINS_JS = """
+const html = document.documentElement.outerHTML;
+return arguments[0].some(text => html.includes(text));
+"""
+
+# the first enabled button containing the text (case insensitive), the button labels are more stable than the
+# generated class names
+FIND_BUTTON_JS = """
+const text = arguments[0].toLowerCase();
+return Array.from(document.querySelectorAll('button'))
+    .find(button => !button.disabled && button.textContent.toLowerCase().includes(text)) || null;
+"""
+
+# Angular registers a testability per app root which knows about pending XHR requests and timers
+_XHR_IDLE_JS = """
+if (document.readyState !== 'complete') return false;
+if (typeof window.getAllAngularTestabilities !== 'function') return true;
+return window.getAllAngularTestabilities().every(testability => testability.isStable());
+"""
+
+
+def page_contains(*texts):
+    def condition(browser: WebDriver):
+        return browser.execute_script(_PAGE_CONTAINS_JS, list(texts))
+
+    return condition
+
+
+def page_not_contains(*texts):
+    def condition(browser: WebDriver):
+        return not browser.execute_script(_PAGE_CONTAINS_JS, list(texts))
+
+    return condition
+
+
+def title_not_contains(text):
+    def condition(browser: WebDriver):
+        return text not in browser.title
+
+    return condition
+
+
+def element_present(css_selector):
+    def condition(browser: WebDriver):
+        return len(browser.find_elements_by_css_selector(css_selector)) > 0
+
+    return condition
+
+
+def element_absent(css_selector):
+    def condition(browser: WebDriver):
+        return len(browser.find_elements_by_css_selector(css_selector)) == 0
+
+    return condition
+
+
+def button_present(text):
+    def condition(browser: WebDriver):
+        return browser.execute_script(FIND_BUTTON_JS, text) is not None
+
+    return condition
+
+
+def xhr_idle(browser: WebDriver):
+    return browser.execute_script(_XHR_IDLE_JS)
+
+
+def all_of(*conditions):
+    def condition(browser: WebDriver):
+        return all(c(browser) for c in conditions)
+
+    return condition
+
+
+def wait_until(browser: WebDriver, condition, timeout, poll_frequency=POLL_FREQUENCY) -> bool:
+    """Waits until the condition is met, returns False if the timeout has occurred."""
+    # selenium is imported on first use, so the modules can be loaded without it (e.g. for --validate)
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    try:
+        WebDriverWait(browser, timeout, poll_frequency=poll_frequency).until(condition)
+        return True
+    except TimeoutException:
+        return False
+
+
+class StepTimer:
+    """Records the duration and the outcome ('ok' or the name of the raised exception) of the steps of a check."""
+
+    def __init__(self):
+        self.steps = []
+        # names of the steps running right now, innermost last
+        self.active = []
+
+    def reset(self):
+        self.steps = []
+        self.active = []
+
+    @contextmanager
+    def step(self, name):
+        start = time.monotonic()
+        outcome = 'ok'
+        self.active.append(name)
+        try:
+            yield
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.active.pop()
+            self.record(name, time.monotonic() - start, outcome)
+
+    def record(self, name, duration, outcome='ok'):
+        self.steps.append((name, duration, outcome))
+
+    def total(self):
+        return sum(duration for _, duration, _ in self.steps)
+
+    def summary(self):
+        return ' '.join(f'{name}={duration:.1f}s' for name, duration, _ in self.steps)